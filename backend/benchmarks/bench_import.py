@@ -0,0 +1,164 @@
+"""
+Время холодного старта: сколько занимает импорт модулей приложения.
+
+Каждый модуль импортируется в отдельном процессе с `python -X importtime`
+(по умолчанию с VERCEL=1, как в serverless-функции). Из отчета берется
+суммарное время импорта модуля, по нескольким запускам считается медиана.
+Выводятся самые медленные зависимости, результат сравнивается с бюджетом
+и, если передан --baseline, с сохраненным базовым замером.
+Также проверяется, что при импорте не загружаются тяжелые модули
+растрового предпросмотра (FORBIDDEN_MODULES).
+При превышении бюджета, регрессии или загрузке таких модулей скрипт
+завершается с кодом 1.
+
+Запуск из папки backend:
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --save-baseline import_baseline.json
+    python benchmarks/bench_import.py --baseline import_baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Бюджет холодного старта, мс: main - сервер FastAPI, worksheet - ядро для api/
+DEFAULT_BUDGETS = {"main": 650.0, "worksheet": 250.0}
+# Модули, которые не должны загружаться при импорте: растровый предпросмотр
+# (Pillow ImageDraw/ImageFont) импортируется только при рисовании изображения.
+# PIL.Image сюда не входит - его при импорте загружает сам ReportLab.
+FORBIDDEN_MODULES = ("raster", "PIL.ImageDraw", "PIL.ImageFont")
+
+
+def parse_importtime(stderr):
+    """
+    Строки отчета -X importtime: список (модуль, собственное время, суммарное время) в мкс
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in parts)
+        # Строка заголовка отчета содержит названия колонок вместо чисел
+        if not self_us.isdigit():
+            continue
+        entries.append((name, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure(module, vercel=True):
+    """
+    Импортирует модуль в новом процессе и возвращает отчет importtime
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    if vercel:
+        env["VERCEL"] = "1"
+    else:
+        env.pop("VERCEL", None)
+    # Процесс запускается в пустой рабочей папке, чтобы не создавать temp в backend
+    with tempfile.TemporaryDirectory() as workdir:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath(BACKEND_DIR), env.get("PYTHONPATH")]))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def bench_module(module, runs, vercel, top):
+    totals = []
+    slowest = {}
+    loaded = set()
+    for _ in range(runs):
+        entries = measure(module, vercel)
+        total = next((cumulative for name, _, cumulative in entries if name == module), 0)
+        totals.append(total / 1000)
+        for name, self_us, _ in entries:
+            slowest.setdefault(name, []).append(self_us / 1000)
+            loaded.add(name)
+    # Самые медленные модули по собственному времени (медиана по запускам)
+    ranked = sorted(
+        ((name, statistics.median(values)) for name, values in slowest.items()),
+        key=lambda item: item[1], reverse=True,
+    )[:top]
+    return {
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "max_ms": round(max(totals), 1),
+        "slowest": [{"module": name, "self_ms": round(ms, 1)} for name, ms in ranked],
+        "forbidden": sorted(name for name in FORBIDDEN_MODULES if name in loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_BUDGETS), help="модули для замера")
+    parser.add_argument("--runs", type=int, default=5, help="запусков на модуль")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых медленных модулей показать")
+    parser.add_argument("--budget", action="append", default=[], metavar="МОДУЛЬ=МС", help="бюджет импорта, мс")
+    parser.add_argument("--local", action="store_true", help="замер без VERCEL=1")
+    parser.add_argument("--baseline", help="JSON с базовым замером для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост медианы относительно базового замера")
+    parser.add_argument("--save-baseline", help="сохранить результат в JSON")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in args.budget:
+        name, _, value = item.partition("=")
+        budgets[name] = float(value)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    failures = []
+    for module in args.modules:
+        result = bench_module(module, args.runs, not args.local, args.top)
+        results[module] = result
+        budget = budgets.get(module)
+        if budget is not None and result["median_ms"] > budget:
+            failures.append(f"{module}: {result['median_ms']} мс больше бюджета {budget} мс")
+        if result["forbidden"]:
+            failures.append(f"{module}: при импорте загружаются {', '.join(result['forbidden'])}")
+        base = baseline.get(module)
+        if base and result["median_ms"] > base["median_ms"] * (1 + args.tolerance):
+            failures.append(f"{module}: {result['median_ms']} мс против {base['median_ms']} мс в базовом замере")
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for module, result in results.items():
+            budget = budgets.get(module)
+            base = baseline.get(module)
+            print(
+                f"{module}: медиана {result['median_ms']} мс (мин {result['min_ms']}, макс {result['max_ms']})"
+                + (f", бюджет {budget} мс" if budget is not None else "")
+                + (f", базовый замер {base['median_ms']} мс" if base else "")
+            )
+            for item in result["slowest"]:
+                print(f"    {item['self_ms']:>8.1f} мс  {item['module']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    for failure in failures:
+        print(f"РЕГРЕССИЯ: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Сравнение наклонной линовки: прежняя отрисовка через весь лист
+против обрезки отрезков по границам линейки.
+
+Запуск из папки backend:
+    python benchmarks/bench_oblique.py [--repeat 200]
+"""
+import argparse
+import io
+import math
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import Color
+from reportlab.lib.pagesizes import A4, landscape
+
+from ruling import MARGIN_LEFT, MARGIN_TOP, LINE_HEIGHT, draw_propisi_lines
+
+
+def draw_oblique_legacy(c, x, y, width, line_height):
+    """
+    Прежняя реализация косых линий: отрезки от 500pt выше страницы до 500pt ниже
+    """
+    c.setStrokeColor(Color(0.8, 0.8, 0.8))
+    c.setLineWidth(0.25)
+    angle = math.radians(-58)
+    extra_distance = 500
+    for offset in range(-1000, int(width) + 1000, 10):
+        start_y = y + extra_distance
+        end_y = -extra_distance
+        delta_x = (start_y - end_y) * math.tan(-angle)
+        c.line(offset, start_y, offset + delta_x, end_y)
+
+
+def draw_legacy(c, x, y, width, line_height):
+    draw_propisi_lines(c, x, y, width, line_height, oblique=False)
+    draw_oblique_legacy(c, x, y, width, line_height)
+
+
+def draw_clipped(c, x, y, width, line_height):
+    draw_propisi_lines(c, x, y, width, line_height, oblique=True)
+
+
+def render(draw, pagesize, compression=1):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=pagesize, pageCompression=compression)
+    width, height = pagesize
+    draw(c, MARGIN_LEFT, height - MARGIN_TOP, width - 2 * MARGIN_LEFT, LINE_HEIGHT)
+    code = "\n".join(c._code)
+    c.save()
+    return buffer.getvalue(), code
+
+
+def count_operators(code):
+    """
+    Количество операторов построения пути (m, l) и обводки (S) в потоке страницы
+    """
+    tokens = code.split()
+    return sum(1 for t in tokens if t in ("m", "l", "S"))
+
+
+def measure(draw, pagesize, repeat):
+    pdf, code = render(draw, pagesize)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render(draw, pagesize)
+    elapsed = (time.perf_counter() - start) / repeat
+    return {
+        "operators": count_operators(code),
+        "stream_bytes": len(code),
+        "stream_deflated": len(zlib.compress(code.encode("latin-1"))),
+        "pdf_bytes": len(pdf),
+        "render_ms": elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="количество повторов для замера времени")
+    args = parser.parse_args()
+
+    for label, pagesize in (("portrait", A4), ("landscape", landscape(A4))):
+        legacy = measure(draw_legacy, pagesize, args.repeat)
+        clipped = measure(draw_clipped, pagesize, args.repeat)
+        print(f"\n{label}")
+        print(f"{'метрика':<18}{'прежняя':>12}{'обрезка':>12}{'выигрыш':>10}")
+        for name in ("operators", "stream_bytes", "stream_deflated", "pdf_bytes", "render_ms"):
+            old, new = legacy[name], clipped[name]
+            ratio = old / new if new else float("inf")
+            print(f"{name:<18}{old:>12.2f}{new:>12.2f}{ratio:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
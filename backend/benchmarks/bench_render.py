@@ -0,0 +1,206 @@
+"""
+Бенчмарк рисования прописей по всем сочетаниям параметров.
+
+Для каждого сочетания fill_type, page_layout, font_type и page_orientation
+рисуется предпросмотр и полный PDF через worksheet.render. Для каждого
+случая выводится время (медиана и минимум по повторам, шаблоны разметки уже прогреты),
+пик памяти по tracemalloc, размер PDF и количество операторов PDF в потоках
+страниц и форм.
+
+Результат можно сохранить как базовый замер и сравнивать с ним следующие
+запуски: при регрессии времени, памяти, размера или числа операторов
+скрипт завершается с кодом 1.
+
+Запуск из папки backend:
+    python benchmarks/bench_render.py
+    python benchmarks/bench_render.py --save-baseline render_baseline.json
+    python benchmarks/bench_render.py --baseline render_baseline.json
+    python benchmarks/bench_render.py --json > result.json
+"""
+import argparse
+import base64
+import contextlib
+import io
+import itertools
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from worksheet import DEFAULT_RENDER_PROFILE, PARAM_CHOICES, RENDER_PROFILES, WorksheetSpec, render
+
+# Текст по умолчанию: полный PDF занимает несколько страниц
+DEFAULT_TEXT = "\n".join(f"Мама мыла раму {i}. Шла Саша по шоссе." for i in range(1, 61))
+# Дата фиксирована, чтобы размер PDF не зависел от дня запуска
+BENCH_DATE = "01.09.2025"
+
+# Операторы потока содержимого PDF (ISO 32000-1, приложение A)
+PDF_OPERATORS = frozenset("""
+    b B b* B* BDC BI BMC BT BX c cm CS cs d d0 d1 Do DP EI EMC ET EX f F f* G g gs h i ID
+    j J K k l m M MP n q Q re RG rg ri s S SC sc SCN scn sh T* Tc Td TD Tf Tj TJ TL Tm Tr Ts
+    Tw Tz v w W W* y ' "
+""".split())
+
+_STREAM_RE = re.compile(rb">>\s*stream\r?\n")
+_STRING_RE = re.compile(rb"\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>")
+
+
+def content_streams(pdf):
+    """
+    Распакованные потоки страниц и форм (шрифты и изображения пропускаются)
+    """
+    for match in _STREAM_RE.finditer(pdf):
+        # Словарь потока - от начала объекта до ключевого слова stream
+        header = pdf[pdf.rfind(b" obj", 0, match.start()):match.start()]
+        if b"/Length1" in header or b"/Image" in header:
+            continue
+        length = int(re.search(rb"/Length (\d+)", header).group(1))
+        data = pdf[match.end():match.end() + length]
+        if b"/ASCII85Decode" in header:
+            # Символы '~' и '>' допустимы в данных ASCII85, поэтому отрезаем ровно маркер конца
+            data = data.strip()
+            if data.endswith(b"~>"):
+                data = data[:-2]
+            data = base64.a85decode(data, adobe=False)
+        if b"/FlateDecode" in header:
+            data = zlib.decompress(data)
+        yield data
+
+
+def count_pdf_operators(pdf):
+    """
+    Количество операторов во всех потоках содержимого PDF
+    """
+    total = 0
+    for stream in content_streams(pdf):
+        # Строки (текст) могут содержать что угодно, поэтому их не считаем
+        tokens = _STRING_RE.sub(b" ", stream).split()
+        total += sum(1 for token in tokens if token.decode("latin-1") in PDF_OPERATORS)
+    return total
+
+
+def bench_case(spec, repeat):
+    # Первый вызов прогревает шаблоны разметки и шрифты
+    pdf = render(spec)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(spec)
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    render(spec)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "time_ms": round(statistics.median(times), 3),
+        # Минимум меньше всего зависит от посторонней нагрузки, по нему ищутся регрессии
+        "min_ms": round(min(times), 3),
+        "peak_kb": round(peak / 1024, 1),
+        "pdf_bytes": len(pdf),
+        "operators": count_pdf_operators(pdf),
+    }
+
+
+def case_name(values, preview):
+    return "/".join(values + ("preview" if preview else "full",))
+
+
+def iter_cases(text, paths, output_profile=DEFAULT_RENDER_PROFILE):
+    names = ("fill_type", "page_layout", "font_type", "page_orientation")
+    for values in itertools.product(*(PARAM_CHOICES[name][0] for name in names)):
+        data = dict(zip(names, values), text=text, student_name="Иванов Иван", date=BENCH_DATE, output_profile=output_profile)
+        for path in paths:
+            preview = path == "preview"
+            yield case_name(values, preview), WorksheetSpec.from_request(data, preview=preview)
+
+
+def compare(results, baseline, args):
+    """
+    Список регрессий относительно базового замера.
+    Размер, операторы и память сравниваются по каждому случаю; время отдельного
+    случая слишком зависит от шума, поэтому сравнивается суммарное время по
+    всем случаям, которые есть в обоих замерах.
+    """
+    regressions = []
+    checks = (
+        ("peak_kb", args.memory_tolerance),
+        ("pdf_bytes", args.size_tolerance),
+        ("operators", 0),
+    )
+    total, base_total = 0.0, 0.0
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        total += result["min_ms"]
+        base_total += base["min_ms"]
+        for metric, tolerance in checks:
+            limit = base[metric] * (1 + tolerance)
+            if result[metric] > limit:
+                regressions.append(f"{name}: {metric} {result[metric]} > {base[metric]} (предел {round(limit, 3)})")
+    limit = base_total * (1 + args.time_tolerance)
+    if total > limit:
+        regressions.append(f"суммарное время {total:.1f} мс > {base_total:.1f} мс (предел {limit:.1f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7, help="повторов на случай для замера времени")
+    parser.add_argument("--paths", nargs="+", choices=("preview", "full"), default=["preview", "full"], help="что рисовать")
+    parser.add_argument("--profile", choices=tuple(RENDER_PROFILES), default=DEFAULT_RENDER_PROFILE, help="профиль вывода PDF")
+    parser.add_argument("--text-file", help="файл с текстом прописи вместо текста по умолчанию")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    parser.add_argument("--baseline", help="JSON с базовым замером для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результат в JSON")
+    parser.add_argument("--time-tolerance", type=float, default=0.3, help="допустимый рост суммарного времени")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2, help="допустимый рост пика памяти")
+    parser.add_argument("--size-tolerance", type=float, default=0.01, help="допустимый рост размера PDF")
+    args = parser.parse_args()
+
+    text = DEFAULT_TEXT
+    if args.text_file:
+        with open(args.text_file, encoding="utf-8") as f:
+            text = f.read()
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, spec in iter_cases(text, args.paths, args.profile):
+            results[name] = bench_case(spec, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'случай':<52}{'время, мс':>11}{'мин, мс':>10}{'пик, КБ':>10}{'PDF, байт':>11}{'операторы':>11}")
+        for name, result in results.items():
+            print(
+                f"{name:<52}{result['time_ms']:>11.2f}{result['min_ms']:>10.2f}{result['peak_kb']:>10.1f}"
+                f"{result['pdf_bytes']:>11}{result['operators']:>11}"
+            )
+        total = sum(result["time_ms"] for result in results.values())
+        print(f"всего случаев: {len(results)}, суммарное время: {total:.1f} мс")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args)
+    for regression in regressions:
+        print(f"РЕГРЕССИЯ: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Сравнение вывода текста на плотной странице: прежняя отрисовка каждой
+строки отдельным drawString (свой блок BT/ET, шрифт и координаты)
+против одного текстового объекта на страницу.
+
+Запуск из папки backend:
+    python benchmarks/bench_text.py [--repeat 200]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reportlab.lib.colors import black
+from reportlab.pdfgen import canvas
+
+from fonts import font_registry
+from ruling import LINE_HEIGHT, MARGIN_LEFT
+from worksheet import (
+    TEXT_FONT_SIZE, TEXT_INSET, WorksheetSpec, draw_propisi_rows, layout_propisi_rows,
+    page_text_geometry, text_fill_color,
+)
+
+CASES = {
+    "one_line": "Мама мыла раму, Шла Саша по шоссе",
+    "first_letter": "\n".join(["Мама", "Арбуз", "Шишка", "Жук", "Юла", "Ёж"] * 5),
+    "all": " ".join(["Шла Саша по шоссе и сосала сушку"] * 60),
+}
+
+
+def draw_rows_legacy(c, rows, y_position, fill_color, font_name):
+    """
+    Прежняя реализация: drawString на каждую строку
+    """
+    c.setFont(font_name, TEXT_FONT_SIZE)
+    c.setFillColor(fill_color)
+    for i, row in enumerate(rows):
+        if row is not None:
+            c.drawString(MARGIN_LEFT + TEXT_INSET, y_position - i * LINE_HEIGHT * 2, row)
+    c.setFillColor(black)
+
+
+def draw_rows_batched(c, rows, y_position, fill_color, font_name):
+    draw_propisi_rows(c, rows, y_position, fill_color, font_name)
+
+
+def render(draw, spec, compression=1):
+    """
+    Страница с текстом: содержимое PDF, код страницы и время вывода текста (без сборки PDF)
+    """
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=spec.pagesize, pageCompression=compression, invariant=1)
+    y_position, rows_per_page = page_text_geometry(spec.pagesize)
+    rows = layout_propisi_rows(spec, rows_per_page)[:rows_per_page]
+    start = time.perf_counter()
+    draw(c, rows, y_position, text_fill_color(spec.font_type), font_registry.resolve(spec.font_family))
+    text_time = time.perf_counter() - start
+    code = "\n".join(c._code)
+    c.save()
+    return buffer.getvalue(), code, text_time
+
+
+def measure(draw, spec, repeat):
+    pdf, code, _ = render(draw, spec)
+    text_time = 0.0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text_time += render(draw, spec)[2]
+    elapsed = (time.perf_counter() - start) / repeat
+    return {
+        "text_objects": code.split().count("BT"),
+        "stream_bytes": len(code),
+        "stream_deflated": len(zlib.compress(code.encode("latin-1"))),
+        "pdf_bytes": len(pdf),
+        "text_ms": text_time / repeat * 1000,
+        "render_ms": elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="количество повторов для замера времени")
+    args = parser.parse_args()
+
+    font_registry.warm()
+    for fill_type, text in CASES.items():
+        spec = WorksheetSpec.from_request({"text": text, "fill_type": fill_type, "font_type": "gray"})
+        legacy = measure(draw_rows_legacy, spec, args.repeat)
+        batched = measure(draw_rows_batched, spec, args.repeat)
+        print(f"\n{fill_type}")
+        print(f"{'метрика':<18}{'прежняя':>12}{'объект':>12}{'выигрыш':>10}")
+        for name in ("text_objects", "stream_bytes", "stream_deflated", "pdf_bytes", "text_ms", "render_ms"):
+            old, new = legacy[name], batched[name]
+            ratio = old / new if new else float("inf")
+            print(f"{name:<18}{old:>12.2f}{new:>12.2f}{ratio:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
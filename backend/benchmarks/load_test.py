@@ -0,0 +1,135 @@
+"""
+Нагрузочный тест: задержки запросов при параллельной генерации PDF.
+
+Для каждого режима исполнителя (RENDER_EXECUTOR) запускается отдельный
+сервер uvicorn. Одновременно отправляются тяжелые запросы /api/generate-pdf
+(с уникальным текстом, чтобы не попадать в кэш), а параллельно
+по одному отправляются легкие запросы /api/test.
+В режиме inline рисование блокирует цикл событий, и легкие запросы
+ждут окончания тяжелых - это видно по p99.
+
+Запуск из папки backend (нужен httpx):
+    python benchmarks/load_test.py --modes inline thread --requests 200 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def wait_ready(client, base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = await client.get(f"{base_url}/api/test")
+            if r.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+
+async def run_load(base_url, total, concurrency, probe_interval, text_lines):
+    latencies = {"heavy": [], "light": []}
+    statuses = {}
+    text = "\n".join(f"Строка для нагрузки {i}" for i in range(text_lines))
+
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency + 1)) as client:
+        await wait_ready(client, base_url)
+        queue = list(range(total))
+        done = asyncio.Event()
+
+        async def heavy_worker():
+            # Тяжелые запросы с уникальным текстом, чтобы не попадать в кэш
+            while queue:
+                i = queue.pop()
+                start = time.perf_counter()
+                r = await client.post(f"{base_url}/api/generate-pdf", json={
+                    "text": f"{text}\n{i}",
+                    "fill_type": "all",
+                    "page_layout": "lines_oblique",
+                    "font_type": "gray",
+                    "stream": True,
+                })
+                latencies["heavy"].append((time.perf_counter() - start) * 1000)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        async def prober():
+            # Легкие запросы по одному, пока идет нагрузка
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get(f"{base_url}/api/test")
+                latencies["light"].append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(probe_interval)
+
+        start = time.perf_counter()
+        probe_task = asyncio.create_task(prober())
+        await asyncio.gather(*(heavy_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+    return latencies, statuses, elapsed
+
+
+def run_mode(mode, args):
+    port = free_port()
+    env = dict(os.environ, RENDER_EXECUTOR=mode, RENDER_WORKERS=str(args.workers))
+    env.pop("VERCEL", None)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        return asyncio.run(run_load(f"http://127.0.0.1:{port}", args.requests, args.concurrency, args.probe_interval, args.lines))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread"], help="режимы RENDER_EXECUTOR")
+    parser.add_argument("--requests", type=int, default=200, help="количество тяжелых запросов")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных тяжелых запросов")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="пауза между легкими запросами, с")
+    parser.add_argument("--workers", type=int, default=4, help="RENDER_WORKERS")
+    parser.add_argument("--lines", type=int, default=300, help="строк текста в тяжелом запросе")
+    args = parser.parse_args()
+
+    print(f"{'режим':<8}{'тип':<7}{'n':>5}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'rps':>8}  статусы")
+    for mode in args.modes:
+        latencies, statuses, elapsed = run_mode(mode, args)
+        rps = args.requests / elapsed  # тяжелых запросов в секунду
+        for kind in ("light", "heavy"):
+            values = latencies[kind]
+            print(
+                f"{mode:<8}{kind:<7}{len(values):>5}"
+                f"{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}"
+                f"{rps:>8.1f}  {statuses}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Пакетная генерация прописей без сервера: листы из манифеста CSV или JSONL.
+
+Каждая строка манифеста - параметры одного листа (поля PropisiRequest:
+text, fill_type, page_layout, font_type, page_orientation, font_family,
+output_profile, student_name, date) и необязательное имя файла filename.
+Листы рисуются в пуле процессов и по мере готовности пишутся в папку или
+в ZIP. Манифест читается потоком, а в работе одновременно не больше
+--window листов, поэтому память не зависит от размера манифеста.
+С --resume уже готовые файлы пропускаются, и прерванный запуск продолжается
+с места остановки (ZIP остается целым, если запуск прерван Ctrl+C или SIGTERM).
+
+Запуск из папки backend:
+    python bulk.py manifest.csv -o out.zip -j 8
+    python bulk.py manifest.jsonl -o out_dir --resume
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import signal
+import sys
+import time
+import zipfile
+from collections import deque
+from multiprocessing import Pool
+
+# Ширина порядкового номера в имени файла (номер строки манифеста)
+INDEX_WIDTH = 6
+# Сколько листов в работе на один процесс (остальные ждут в манифесте)
+WINDOW_PER_WORKER = 4
+# Как часто печатать прогресс, листов
+PROGRESS_EVERY = 500
+
+
+def read_manifest(path, manifest_format=None):
+    """
+    Строки манифеста по одной: (номер строки с 1, параметры или текст ошибки)
+    """
+    if manifest_format is None:
+        manifest_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if manifest_format == "csv":
+            for index, row in enumerate(csv.DictReader(f), start=1):
+                # Пустые ячейки - параметр не задан, берется значение по умолчанию
+                yield index, {key: value for key, value in row.items() if key and value not in (None, "")}
+            return
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            index += 1
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield index, f"некорректный JSON: {e}"
+                continue
+            yield index, data if isinstance(data, dict) else "строка должна быть объектом JSON"
+
+
+def output_filename(index, data):
+    """
+    Имя файла листа: номер строки манифеста и имя (filename или имя ученика) без служебных символов
+    """
+    name = str(data.get("filename") or data.get("student_name") or "")
+    if name.lower().endswith(".pdf"):
+        name = name[:-4]
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name).strip("_")
+    return f"{index:0{INDEX_WIDTH}d}_{safe_name or 'sheet'}.pdf"
+
+
+def init_worker(default_date):
+    """
+    Подготовка процесса пула: Ctrl+C обрабатывает главный процесс, шрифты
+    и шаблоны разметки загружаются один раз на процесс
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Обработчик SIGTERM главного процесса не нужен: пул останавливает процессы через SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    global _default_date
+    _default_date = default_date
+    from fonts import font_registry
+    from ruling import warm_ruling_templates
+
+    font_registry.warm()
+    warm_ruling_templates()
+
+
+_default_date = None
+
+
+def render_row(task):
+    """
+    Рисует один лист (в процессе пула).
+    Возвращает (номер, имя файла, PDF или None, страниц, секунд, pid, ошибка).
+    """
+    from worksheet import WorksheetSpec, render_to
+
+    index, filename, data = task
+    start = time.perf_counter()
+    try:
+        if _default_date and not data.get("date"):
+            data = dict(data, date=_default_date)
+        buffer = io.BytesIO()
+        pages = render_to(WorksheetSpec.from_request(data), buffer)
+        return index, filename, buffer.getvalue(), pages, time.perf_counter() - start, os.getpid(), None
+    except Exception as e:
+        return index, filename, None, 0, time.perf_counter() - start, os.getpid(), str(e)
+
+
+class DirectorySink:
+    """
+    Готовые PDF в папке; файл появляется под своим именем только целиком
+    """
+
+    def __init__(self, path, resume):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.done = set(os.listdir(path)) if resume else set()
+
+    def write(self, filename, content):
+        target = os.path.join(self.path, filename)
+        partial = target + ".part"
+        with open(partial, "wb") as f:
+            f.write(content)
+        os.replace(partial, target)
+
+    def close(self):
+        pass
+
+
+class ZipSink:
+    """
+    Готовые PDF в ZIP без повторного сжатия (PDF уже сжаты).
+    С resume архив дополняется, уже записанные файлы пропускаются.
+    """
+
+    def __init__(self, path, resume):
+        mode = "a" if resume and os.path.exists(path) else "w"
+        try:
+            self.archive = zipfile.ZipFile(path, mode, zipfile.ZIP_STORED, allowZip64=True)
+        except zipfile.BadZipFile:
+            raise SystemExit(
+                f"Архив {path} поврежден (запуск был остановлен аварийно) и не может быть продолжен; "
+                "для надежного продолжения используйте вывод в папку"
+            )
+        self.done = set(self.archive.namelist()) if mode == "a" else set()
+
+    def write(self, filename, content):
+        self.archive.writestr(filename, content)
+
+    def close(self):
+        self.archive.close()
+
+
+class BulkStats:
+    """
+    Итоги запуска: всего и по процессам пула
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.documents = 0
+        self.pages = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.failed = 0
+        self.workers = {}
+
+    def add(self, pid, pages, seconds, size):
+        self.documents += 1
+        self.pages += pages
+        self.bytes += size
+        worker = self.workers.setdefault(pid, {"documents": 0, "pages": 0, "seconds": 0.0})
+        worker["documents"] += 1
+        worker["pages"] += pages
+        worker["seconds"] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def progress(self):
+        elapsed = self.elapsed()
+        return (
+            f"готово {self.documents} листов ({self.pages} стр.) за {elapsed:.1f} с, "
+            f"{self.pages / elapsed if elapsed else 0:.1f} стр/с"
+        )
+
+    def report(self):
+        elapsed = self.elapsed()
+        lines = [
+            f"листов: {self.documents}, страниц: {self.pages}, пропущено: {self.skipped}, ошибок: {self.failed}",
+            f"объем: {self.bytes / 1024 / 1024:.1f} МБ, время: {elapsed:.1f} с",
+            f"скорость: {self.documents / elapsed if elapsed else 0:.1f} листов/с, "
+            f"{self.pages / elapsed if elapsed else 0:.1f} стр/с",
+            "",
+            f"{'процесс':<10}{'листов':>10}{'страниц':>10}{'занят, с':>12}{'стр/с':>10}",
+        ]
+        for pid, worker in sorted(self.workers.items()):
+            rate = worker["pages"] / worker["seconds"] if worker["seconds"] else 0
+            lines.append(f"{pid:<10}{worker['documents']:>10}{worker['pages']:>10}{worker['seconds']:>12.2f}{rate:>10.1f}")
+        return "\n".join(lines)
+
+
+def raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(args):
+    if os.path.exists(args.output) and not (args.resume or args.overwrite):
+        raise SystemExit(f"{args.output} уже существует: укажите --resume, чтобы продолжить, или --overwrite")
+    is_zip = args.output.lower().endswith(".zip")
+    if args.overwrite and not args.resume and is_zip and os.path.exists(args.output):
+        os.remove(args.output)
+    sink = ZipSink(args.output, args.resume) if is_zip else DirectorySink(args.output, args.resume)
+
+    stats = BulkStats()
+    window = args.window or args.workers * WINDOW_PER_WORKER
+    # SIGTERM завершает запуск так же аккуратно, как Ctrl+C
+    signal.signal(signal.SIGTERM, raise_interrupt)
+    pool = Pool(args.workers, initializer=init_worker, initargs=(args.date,))
+    pending = deque()
+
+    def handle(result):
+        index, filename, content, pages, seconds, pid, error = result
+        if error is not None:
+            stats.failed += 1
+            print(f"строка {index}: ошибка: {error}", file=sys.stderr)
+            return
+        sink.write(filename, content)
+        stats.add(pid, pages, seconds, len(content))
+        if stats.documents % PROGRESS_EVERY == 0:
+            print(stats.progress(), file=sys.stderr)
+
+    interrupted = False
+    try:
+        for index, data in read_manifest(args.manifest, args.format):
+            if isinstance(data, str):
+                stats.failed += 1
+                print(f"строка {index}: {data}", file=sys.stderr)
+                continue
+            filename = output_filename(index, data)
+            if filename in sink.done:
+                stats.skipped += 1
+                continue
+            pending.append(pool.apply_async(render_row, ((index, filename, data),)))
+            # Не больше window листов в работе: ждем самый старый
+            if len(pending) >= window:
+                handle(pending.popleft().get())
+        while pending:
+            handle(pending.popleft().get())
+        pool.close()
+    except KeyboardInterrupt:
+        interrupted = True
+        pool.terminate()
+    finally:
+        pool.join()
+        sink.close()
+
+    print(stats.report())
+    if interrupted:
+        print("Запуск прерван; продолжить: тот же запуск с --resume", file=sys.stderr)
+        return 130
+    return 1 if stats.failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="файл манифеста: .csv (с заголовком) или .jsonl")
+    parser.add_argument("-o", "--output", required=True, help="папка или файл .zip для готовых PDF")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="количество процессов")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="формат манифеста (по умолчанию - по расширению)")
+    parser.add_argument("--window", type=int, default=0, help="сколько листов одновременно в работе")
+    parser.add_argument("--date", help="дата для строк без даты (ДД.ММ.ГГГГ или ГГГГ-ММ-ДД)")
+    parser.add_argument("--resume", action="store_true", help="продолжить прерванный запуск")
+    parser.add_argument("--overwrite", action="store_true", help="перезаписать существующий вывод")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Реестр шрифтов прописей.
+
+TTF из папки fonts регистрируются в ReportLab один раз на процесс, при
+первом обращении к шрифту. Ширины символов кэшируются по шрифту, поэтому
+измерение строк не обращается к метрикам ReportLab на каждый вызов.
+"""
+import os
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+# Семейство шрифта в запросе -> (имя шрифта в ReportLab, файл TTF или None для стандартного)
+FONT_FAMILIES = {
+    "propisi": ("Propisi", "propisi.ttf"),
+    "ilyukhina": ("Ilyukhina", "ilyukhina.ttf"),
+    "helvetica": ("Helvetica", None),
+}
+DEFAULT_FONT_FAMILY = "propisi"
+# Стандартный шрифт на случай, если файл TTF недоступен
+FALLBACK_FONT = "Helvetica"
+
+
+class FontRegistry:
+    """
+    Ленивая регистрация шрифтов и кэш ширин символов.
+    Безопасен для использования из нескольких потоков; в каждом процессе
+    пула шрифты регистрируются заново при первом обращении.
+    """
+
+    def __init__(self, families=FONT_FAMILIES, fonts_dir=FONTS_DIR):
+        self.families = dict(families)
+        self.fonts_dir = fonts_dir
+        self._resolved = {}
+        self._widths = {}
+        self._lock = threading.Lock()
+
+    def family_names(self):
+        return tuple(self.families)
+
+    def resolve(self, family):
+        """
+        Имя шрифта ReportLab для семейства; регистрирует TTF при первом обращении
+        """
+        font_name = self._resolved.get(family)
+        if font_name is None:
+            with self._lock:
+                font_name = self._resolved.get(family)
+                if font_name is None:
+                    font_name = self._register(family)
+                    self._resolved[family] = font_name
+        return font_name
+
+    def _register(self, family):
+        if family not in self.families:
+            family = DEFAULT_FONT_FAMILY
+        font_name, filename = self.families[family]
+        if filename is None:
+            return font_name
+        if font_name in pdfmetrics.getRegisteredFontNames():
+            return font_name
+        path = os.path.join(self.fonts_dir, filename)
+        try:
+            from reportlab.pdfbase.ttfonts import TTFont
+            pdfmetrics.registerFont(TTFont(font_name, path))
+            print(f"Зарегистрирован шрифт {font_name} из {path}")
+            return font_name
+        except Exception as e:
+            print(f"Не удалось загрузить шрифт {path}: {e}. Используем {FALLBACK_FONT}")
+            return FALLBACK_FONT
+
+    def font_file(self, font_name):
+        """
+        Путь к файлу TTF для имени шрифта ReportLab или None для стандартных шрифтов
+        """
+        for name, filename in self.families.values():
+            if name == font_name and filename:
+                return os.path.join(self.fonts_dir, filename)
+        return None
+
+    def char_widths(self, font_name):
+        """
+        Ширины символов шрифта при размере 1pt; заполняются по мере обращения
+        """
+        widths = self._widths.get(font_name)
+        if widths is None:
+            with self._lock:
+                widths = self._widths.setdefault(font_name, {})
+        return widths
+
+    def string_width(self, text, font_name, size):
+        """
+        Ширина строки в пунктах (ReportLab не применяет кернинг, поэтому
+        ширина строки равна сумме ширин символов)
+        """
+        widths = self.char_widths(font_name)
+        total = 0.0
+        for ch in text:
+            width = widths.get(ch)
+            if width is None:
+                width = pdfmetrics.stringWidth(ch, font_name, 1)
+                widths[ch] = width
+            total += width
+        return total * size
+
+    def warm(self):
+        """
+        Регистрирует все шрифты заранее (например, при запуске сервера)
+        """
+        return [self.resolve(family) for family in self.families]
+
+
+font_registry = FontRegistry()
@@ -0,0 +1,226 @@
+"""
+Пунктирный текст для обведения: контуры букв обводятся точками.
+
+Контуры глифов читаются из TTF шрифта прописей через fontTools и
+переводятся в операторы пути PDF. Готовый путь глифа кэшируется на процесс
+по (файл шрифта, глиф, размер, пунктир), а в документе каждый глиф - одна
+Form XObject, на которую ссылаются все его повторения. Поэтому страница
+одной повторенной строки (one_line) стоит одно извлечение контура на
+каждую различную букву.
+
+fontTools импортируется при первом пунктирном листе, чтобы не замедлять
+холодный старт. Для шрифтов без файла TTF (стандартные шрифты PDF) и для
+растрового предпросмотра текст рисуется обычной заливкой.
+"""
+import hashlib
+import threading
+
+from reportlab.lib.colors import Color
+from reportlab.lib.rl_accel import fp_str
+
+from fonts import font_registry
+
+# Пунктир обводки: длина штриха и промежутка в пунктах (штрих 0 с круглым концом - точка)
+PUNKTIR_DASH = (0, 1.3)
+PUNKTIR_LINE_WIDTH = 0.55
+PUNKTIR_COLOR = Color(0.45, 0.45, 0.45)
+
+
+_pen_class = None
+
+
+def pdf_path_pen(glyph_set, scale):
+    """
+    Перо fontTools, которое записывает контур операторами пути PDF
+    (квадратичные кривые TrueType переводятся в кубические базовым классом)
+    """
+    global _pen_class
+    if _pen_class is None:
+        from fontTools.pens.basePen import BasePen
+
+        class PdfPathPen(BasePen):
+            def __init__(self, glyph_set, scale):
+                super().__init__(glyph_set)
+                self.scale = scale
+                self.ops = []
+
+            def _point(self, pt):
+                return fp_str(pt[0] * self.scale, pt[1] * self.scale)
+
+            def _moveTo(self, pt):
+                self.ops.append(f"{self._point(pt)} m")
+
+            def _lineTo(self, pt):
+                self.ops.append(f"{self._point(pt)} l")
+
+            def _curveToOne(self, pt1, pt2, pt3):
+                self.ops.append(f"{self._point(pt1)} {self._point(pt2)} {self._point(pt3)} c")
+
+            def _closePath(self):
+                self.ops.append("h")
+
+        _pen_class = PdfPathPen
+    return _pen_class(glyph_set, scale)
+
+
+class GlyphOutlines:
+    """
+    Контуры глифов одного файла TTF; файл читается при первом обращении
+    """
+
+    def __init__(self, path):
+        from fontTools.ttLib import TTFont
+
+        font = TTFont(path, lazy=True)
+        self.glyph_set = font.getGlyphSet()
+        self.cmap = font.getBestCmap() or {}
+        head = font["head"]
+        self.units_per_em = head.unitsPerEm
+        self.bbox = (head.xMin, head.yMin, head.xMax, head.yMax)
+
+    def path_ops(self, ch, size):
+        """
+        Операторы пути PDF для контура символа при размере size или None,
+        если в шрифте нет глифа или он пустой (например, пробел)
+        """
+        glyph_name = self.cmap.get(ord(ch))
+        if glyph_name is None:
+            return None
+        pen = pdf_path_pen(self.glyph_set, size / self.units_per_em)
+        self.glyph_set[glyph_name].draw(pen)
+        return "\n".join(pen.ops) or None
+
+    def scaled_bbox(self, size):
+        scale = size / self.units_per_em
+        return tuple(value * scale for value in self.bbox)
+
+
+class DottedGlyphCache:
+    """
+    Кэш пунктирных глифов на процесс:
+    (шрифт, символ, размер, пунктир) -> (имя формы, код формы, ширина символа)
+    """
+
+    def __init__(self):
+        self._outlines = {}
+        self._glyphs = {}
+        self._lock = threading.Lock()
+
+    def outlines(self, font_name):
+        """
+        Контуры шрифта или None, если у шрифта нет файла TTF
+        """
+        if font_name not in self._outlines:
+            path = font_registry.font_file(font_name)
+            with self._lock:
+                if font_name not in self._outlines:
+                    self._outlines[font_name] = GlyphOutlines(path) if path else None
+        return self._outlines[font_name]
+
+    def glyph(self, font_name, ch, size, dash=PUNKTIR_DASH):
+        """
+        Имя и код формы пунктирного глифа (обводка контура пунктиром) и ширина символа.
+        Для пустых глифов (пробел) имя и код - None.
+        """
+        key = (font_name, ch, size, dash)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            outlines = self.outlines(font_name)
+            # Таблицы шрифта fontTools читает лениво, поэтому контуры извлекаются под блокировкой
+            with self._lock:
+                glyph = self._glyphs.get(key)
+                if glyph is None:
+                    name, code = None, outlines.path_ops(ch, size)
+                    if code is not None:
+                        name = glyph_form_name(font_name, ch, size, dash)
+                        code = f"1 J 1 j {fp_str(PUNKTIR_LINE_WIDTH)} w [{fp_str(*dash)}] 0 d\n{code}\nS"
+                    glyph = (name, code, font_registry.string_width(ch, font_name, size))
+                    self._glyphs[key] = glyph
+        return glyph
+
+
+dotted_glyphs = DottedGlyphCache()
+
+
+def supports_dotted(c, font_name):
+    """
+    Можно ли нарисовать пунктир: нужен холст PDF (с формами) и шрифт из файла TTF
+    """
+    return hasattr(c, "beginForm") and font_registry.font_file(font_name) is not None
+
+
+def glyph_form_name(font_name, ch, size, dash):
+    dash_key = "_".join(str(round(value * 100)) for value in dash)
+    return f"dot_{font_name}_{ord(ch):x}_{round(size * 100)}_{dash_key}"
+
+
+def _glyph_bbox(font_name, size):
+    x_min, y_min, x_max, y_max = dotted_glyphs.outlines(font_name).scaled_bbox(size)
+    pad = PUNKTIR_LINE_WIDTH
+    return x_min - pad, y_min - pad, x_max + pad, y_max + pad
+
+
+def glyph_run(c, text, font_name, size, dash=PUNKTIR_DASH):
+    """
+    Формы глифов строки (создаются в документе при первом использовании)
+    и ширины символов: список (имя формы или None, ширина)
+    """
+    run = []
+    for ch in text:
+        name, code, advance = dotted_glyphs.glyph(font_name, ch, size, dash)
+        if name is not None and not c.hasForm(name):
+            c.beginForm(name, *_glyph_bbox(font_name, size))
+            c.addLiteral(code)
+            c.endForm()
+        run.append((name, advance))
+    return run
+
+
+def _place_form(c, name, x, y):
+    c.addLiteral(f"q 1 0 0 1 {fp_str(x, y)} cm")
+    c.doForm(name)
+    c.addLiteral("Q")
+
+
+def draw_dotted_string(c, x, y, text, font_name, size, dash=PUNKTIR_DASH):
+    """
+    Рисует строку пунктирными контурами букв. Буквы расставляются по тем же
+    ширинам, что и обычный текст (fonts.FontRegistry.string_width).
+    """
+    cursor = x
+    for name, advance in glyph_run(c, text, font_name, size, dash):
+        if name is not None:
+            _place_form(c, name, cursor, y)
+        cursor += advance
+
+
+def draw_dotted_rows(c, rows, x, y_position, line_step, font_name, size, dash=PUNKTIR_DASH):
+    """
+    Рисует строки прописи пунктиром. Строка, которая повторяется (one_line),
+    собирается в форму один раз, и каждое повторение - одна ссылка на нее.
+    """
+    counts = {}
+    for row in rows:
+        if row:
+            counts[row] = counts.get(row, 0) + 1
+
+    for i, row in enumerate(rows):
+        if not row:
+            continue
+        y = y_position - i * line_step
+        if counts[row] == 1:
+            draw_dotted_string(c, x, y, row, font_name, size, dash)
+            continue
+        name = "dotrow_" + hashlib.sha1(f"{font_name}|{size}|{dash}|{row}".encode("utf-8")).hexdigest()[:16]
+        if not c.hasForm(name):
+            # Формы глифов создаются до формы строки, чтобы не вкладывать одну в другую
+            run = glyph_run(c, row, font_name, size, dash)
+            x_min, y_min, x_max, y_max = _glyph_bbox(font_name, size)
+            c.beginForm(name, x_min, y_min, sum(advance for _, advance in run) + x_max, y_max)
+            cursor = 0.0
+            for glyph_name, advance in run:
+                if glyph_name is not None:
+                    _place_form(c, glyph_name, cursor, 0)
+                cursor += advance
+            c.endForm()
+        _place_form(c, name, x, y)
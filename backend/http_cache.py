@@ -0,0 +1,104 @@
+"""
+Сильные ETag и условные запросы для готовых файлов.
+
+Листы рисуются детерминированно (см. worksheet.render_to), поэтому ETag
+считается от содержимого: одинаковый документ всегда получает одинаковый
+ETag. GET-маршруты отвечают 304 Not Modified, если ETag совпал с
+If-None-Match, и тогда файл не читается и не передается повторно.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Размер блока при хешировании файла
+HASH_CHUNK_SIZE = 64 * 1024
+# Сколько ETag файлов помнить (файлы временные, поэтому кэш небольшой)
+FILE_ETAGS_KEEP = 1024
+
+# Файлы во временном хранилище не меняются: у каждого свое уникальное имя
+IMMUTABLE_CACHE_CONTROL = "private, max-age={max_age}, immutable"
+# Ответы на POST браузер не кэширует, но может сверить ETag при повторной загрузке
+DIRECT_CACHE_CONTROL = "private, no-cache"
+
+
+def content_etag(content: bytes) -> str:
+    """
+    Сильный ETag для содержимого
+    """
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+class FileETags:
+    """
+    ETag файлов по содержимому. Хеш запоминается по (размер, время изменения),
+    поэтому повторные запросы того же файла не читают его с диска.
+    """
+
+    def __init__(self, keep=FILE_ETAGS_KEEP):
+        self.keep = keep
+        self._etags = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            etag = self._etags.get(key)
+            if etag is not None:
+                self._etags.move_to_end(key)
+                return etag
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        etag = f'"{digest.hexdigest()[:32]}"'
+
+        with self._lock:
+            self._etags[key] = etag
+            while len(self._etags) > self.keep:
+                self._etags.popitem(last=False)
+        return etag
+
+    def remember(self, path, content):
+        """
+        Запоминает ETag только что записанного файла, чтобы не хешировать его заново
+        """
+        st = os.stat(path)
+        etag = content_etag(content)
+        with self._lock:
+            self._etags[(path, st.st_size, st.st_mtime_ns)] = etag
+            while len(self._etags) > self.keep:
+                self._etags.popitem(last=False)
+        return etag
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Сравнение по правилам If-None-Match: список ETag через запятую или "*",
+    префикс слабого ETag (W/) не учитывается
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag, cache_control):
+    """
+    Ответ 304, если у клиента уже есть эта версия файла, иначе None
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
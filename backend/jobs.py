@@ -0,0 +1,144 @@
+"""
+Фоновые задачи генерации больших PDF.
+
+POST создает задачу и сразу возвращает ее идентификатор, рисование идет
+в фоне, а клиент опрашивает состояние задачи. Хранилище задач отделено
+интерфейсом JobBackend, чтобы локальную очередь можно было заменить
+внешней (Redis, база данных) без изменения маршрутов.
+"""
+import asyncio
+import time
+import uuid
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+
+
+class JobQueueFull(Exception):
+    """
+    Очередь задач заполнена
+    """
+
+
+class JobBackend:
+    """
+    Интерфейс очереди задач.
+
+    runner - корутина runner(payload), которая выполняет задачу
+    и возвращает словарь с результатом (например, file_url).
+    """
+
+    async def start(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def submit(self, payload):
+        """
+        Ставит задачу в очередь и возвращает ее описание
+        """
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """
+        Описание задачи или None, если задача не найдена
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LocalJobQueue(JobBackend):
+    """
+    Очередь задач внутри процесса: asyncio.Queue и фиксированное число
+    обработчиков, которые ограничивают количество одновременных рисований.
+    """
+
+    def __init__(self, runner, workers=2, max_queued=100, ttl=3600):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl = ttl
+        self._jobs = {}
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, payload):
+        if self._queue is None:
+            raise RuntimeError("Очередь задач не запущена")
+        self._purge()
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"В очереди уже {self._queue.qsize()} задач")
+        job = {
+            "id": uuid.uuid4().hex,
+            "state": JOB_QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        self._jobs[job["id"]] = job
+        self._queue.put_nowait((job["id"], payload))
+        return dict(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def stats(self):
+        states = {}
+        for job in self._jobs.values():
+            states[job["state"]] = states.get(job["state"], 0) + 1
+        return {
+            "backend": "local",
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self.max_queued,
+            "jobs": states,
+        }
+
+    async def _worker(self):
+        while True:
+            job_id, payload = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            job["state"] = JOB_RUNNING
+            job["started_at"] = time.time()
+            try:
+                job["result"] = await self.runner(payload)
+                job["state"] = JOB_DONE
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка в фоновой задаче {job_id}: {str(e)}")
+                job["error"] = f"{type(e).__name__}: {str(e)}"
+                job["state"] = JOB_ERROR
+            finally:
+                job["finished_at"] = time.time()
+                self._queue.task_done()
+
+    def _purge(self):
+        # Забываем завершенные задачи старше ttl
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
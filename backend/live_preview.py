@@ -0,0 +1,123 @@
+"""
+Живой предпросмотр по WebSocket (/ws/preview).
+
+Клиент присылает изменения параметров листа (JSON с любыми полями
+PropisiRequest, а также format и dpi); сервер склеивает их, ждет паузу в
+потоке изменений (debounce) и присылает обновленный предпросмотр. Сессия
+помнит сцену предыдущего предпросмотра (scene.py) и готовые растровые слои
+(разметка, разметка с шапкой), поэтому при наборе текста перерисовывается
+только слой текста, а если сцена не изменилась, предпросмотр не рисуется.
+Количество сессий и память под их слои ограничены.
+"""
+import os
+import time
+
+from raster_formats import MAX_DPI, MIN_DPI, RASTER_FORMATS
+from worksheet import WorksheetSpec, build_scenes, render
+
+# Пауза в потоке изменений, после которой рисуется предпросмотр, секунды
+LIVE_PREVIEW_DEBOUNCE = float(os.environ.get("LIVE_PREVIEW_DEBOUNCE_MS", 150)) / 1000
+LIVE_PREVIEW_FORMATS = tuple(RASTER_FORMATS) + ("svg", "pdf")
+# Ограничение на размер текста в одном сообщении
+MAX_MESSAGE_TEXT = 20000
+# Сколько соединений живого предпросмотра открыто одновременно
+LIVE_PREVIEW_MAX_SESSIONS = int(os.environ.get("LIVE_PREVIEW_MAX_SESSIONS", 32))
+# Сколько памяти сессия может занять своими растровыми слоями. Если слои сцены
+# при текущем dpi больше, сессия пользуется общим кэшем слоев (raster.py),
+# размер которого ограничен для всего процесса.
+LIVE_PREVIEW_LAYER_MAX_BYTES = int(os.environ.get("LIVE_PREVIEW_LAYER_MAX_BYTES", 8 * 1024 * 1024))
+# Пауза перед повторным рисованием, если исполнитель перегружен: от начальной до
+# максимальной, удваивается с каждой неудачной попыткой, секунды
+LIVE_PREVIEW_BACKOFF = float(os.environ.get("LIVE_PREVIEW_BACKOFF_MS", 500)) / 1000
+LIVE_PREVIEW_MAX_BACKOFF = float(os.environ.get("LIVE_PREVIEW_MAX_BACKOFF_MS", 8000)) / 1000
+
+
+class LivePreviewSession:
+    """
+    Состояние одного соединения: накопленные параметры, сцена последнего
+    предпросмотра и растровые слои, которые она оставила
+    """
+
+    def __init__(self):
+        self.params = {}
+        self.image_format = "png"
+        self.dpi = 96
+        self.scene = None
+        self.sent_format = None
+        self.layers = {}
+
+    def update(self, message):
+        """
+        Применяет изменения из сообщения клиента. ValueError - если сообщение некорректно;
+        тогда сессия не меняется: сообщение сначала проверяется целиком.
+        """
+        if not isinstance(message, dict):
+            raise ValueError("Сообщение должно быть объектом JSON с параметрами листа")
+        if len(str(message.get("text") or "")) > MAX_MESSAGE_TEXT:
+            raise ValueError("Слишком длинный текст")
+        changes = dict(message)
+        image_format = changes.pop("format", None)
+        if image_format is not None:
+            image_format = str(image_format).strip().lower()
+            if image_format not in LIVE_PREVIEW_FORMATS:
+                raise ValueError(f"Неизвестный формат предпросмотра: {image_format}")
+        dpi = changes.pop("dpi", None)
+        if dpi is not None:
+            try:
+                dpi = max(MIN_DPI, min(MAX_DPI, int(dpi)))
+            except (TypeError, ValueError):
+                raise ValueError("dpi должен быть числом")
+
+        if image_format is not None:
+            self.image_format = image_format
+        if dpi is not None:
+            self.dpi = dpi
+        self.params.update(changes)
+
+    def layer_bytes(self, scene):
+        """
+        Сколько памяти займут слои сцены (все группы, кроме последней) при текущем dpi
+        """
+        width, height = scene.pagesize
+        pixels = int(round(width * self.dpi / 72)) * int(round(height * self.dpi / 72))
+        return pixels * 3 * (len(scene.groups) - 1)
+
+    def render(self, timings=None):
+        """
+        Рисует предпросмотр по накопленным параметрам. Возвращает (сведения, содержимое);
+        содержимое - None, если с прошлого раза ничего не изменилось.
+        """
+        start = time.perf_counter()
+        spec = WorksheetSpec.from_request(self.params, preview=True)
+        scene = build_scenes(spec)[0]
+        output = (self.image_format, self.dpi)
+        changed = scene.diff(self.scene) if output == self.sent_format else scene.diff(None)
+        info = {"digest": scene.digest, "format": self.image_format, "changed": list(changed)}
+        if not changed:
+            return dict(info, status="unchanged"), None
+
+        if self.image_format in RASTER_FORMATS:
+            from raster import render_scene_image
+
+            if self.layer_bytes(scene) > LIVE_PREVIEW_LAYER_MAX_BYTES:
+                # Слишком большие слои сессия не держит: берем общий ограниченный кэш
+                self.layers.clear()
+                c = render_scene_image(scene, self.dpi, timings)
+            else:
+                c = render_scene_image(scene, self.dpi, timings, layers=self.layers)
+                # Сессии нужны только слои текущей сцены
+                current = {(digest, self.dpi) for digest in scene.prefix_digests()}
+                for key in [key for key in self.layers if key not in current]:
+                    del self.layers[key]
+            content = c.to_bytes(self.image_format)
+        elif self.image_format == "svg":
+            from svg import render_scene_svg
+
+            content = render_scene_svg(scene, timings)
+        else:
+            content = render(spec, timings)
+
+        self.scene = scene
+        self.sent_format = output
+        info.update(status="success", size=len(content), render_ms=round((time.perf_counter() - start) * 1000, 2))
+        return info, content
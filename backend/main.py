@@ -1,27 +1,35 @@
-from fastapi import FastAPI, Form, File, UploadFile, HTTPException, Request
-from fastapi.responses import FileResponse, Response, JSONResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response, JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Optional, List, Union, Annotated
+from typing import Optional
 import os
 import io
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.colors import black, gray, red, Color, lightgrey, white
+from reportlab.lib.pagesizes import A4
 import tempfile
 import shutil
-import math
-from reportlab.graphics.shapes import Path, String, Group
-from reportlab.graphics import renderPDF
-from reportlab.lib.units import mm
-from reportlab.pdfbase._fontdata import standardFonts
-from reportlab.pdfbase import _fontdata
 import datetime
 import sys
+import asyncio
+import json
+from pdf_cache import PdfCache, make_cache_key
+from render_executor import RenderExecutor, RenderQueueFull
+from jobs import LocalJobQueue, JobQueueFull
+from storage import TempStorage
+from http_cache import FileETags, content_etag, not_modified, IMMUTABLE_CACHE_CONTROL, DIRECT_CACHE_CONTROL
+from metrics import MetricsRegistry, MetricsMiddleware, call_with_timings, record_phase, record_phases, profiling_requested, attach_profile
+from raster_formats import RASTER_FORMATS, MIN_DPI, MAX_DPI
+from svg import SVG_MEDIA_TYPE
+from live_preview import (
+    LIVE_PREVIEW_BACKOFF, LIVE_PREVIEW_DEBOUNCE, LIVE_PREVIEW_MAX_BACKOFF, LIVE_PREVIEW_MAX_SESSIONS, LivePreviewSession,
+)
+from fonts import DEFAULT_FONT_FAMILY, font_registry
+from ruling import warm_ruling_templates
+from nup import NupSpec, render_nup
+from worksheet import (
+    PageLimitExceeded, WorksheetSpec, render, render_to, render_image, render_svg, render_class_pack_to, render_size_report,
+)
 
 # Начальные настройки для отладки
 print("Инициализация приложения на", "Vercel" if os.environ.get('VERCEL', False) else "локальном сервере")
@@ -42,6 +50,10 @@ app.add_middleware(
     allow_headers=["*", "Content-Type", "Authorization"],  # Разрешаем все заголовки и конкретные
 )
 
+# Метрики запросов для /metrics; профилирование по заголовку X-Profile (см. metrics.py)
+metrics_registry = MetricsRegistry()
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+
 # Модель данных для запроса
 class PropisiRequest(BaseModel):
     task: str
@@ -50,41 +62,32 @@ class PropisiRequest(BaseModel):
     page_layout: str  # "cells", "lines", "lines_oblique"
     font_type: str  # "punktir", "gray", "black"
     page_orientation: str  # "portrait", "landscape"
+    font_family: Optional[str] = None  # "propisi", "ilyukhina", "helvetica"
+    output_profile: Optional[str] = None  # "screen", "print", "uncompressed"
     student_name: Optional[str] = None
+    date: Optional[str] = None  # "ДД.ММ.ГГГГ" или "ГГГГ-ММ-ДД", по умолчанию сегодня
 
 # Создаем папку для временных файлов
 # На Vercel используем /tmp директорию, которая доступна для serverless функций
-if os.environ.get('VERCEL', False):
+IS_VERCEL = bool(os.environ.get('VERCEL', False))
+if IS_VERCEL:
+    # /tmp всегда существует и доступна для записи, лишних обращений к диску при запуске не делаем
     temp_dir = "/tmp"
 else:
-temp_dir = "temp"
-os.makedirs(temp_dir, exist_ok=True)
-
-# Проверяем возможность записи во временную директорию
-try:
-    test_file = os.path.join(temp_dir, "test_write.txt")
-    with open(test_file, "w") as f:
-        f.write("test")
-    if os.path.exists(test_file):
-        os.remove(test_file)
-        print(f"Временная директория {temp_dir} доступна для записи")
-    else:
-        print(f"Не удалось проверить запись в {temp_dir}")
-except Exception as e:
-    print(f"Ошибка при проверке временной директории: {str(e)}")
-    # На Vercel попробуем использовать базовый tmp каталог
-    if os.environ.get('VERCEL', False):
-        temp_dir = "/tmp"
-        print(f"Используем альтернативный временный каталог: {temp_dir}")
-        os.makedirs(temp_dir, exist_ok=True)
+    temp_dir = "temp"
+    os.makedirs(temp_dir, exist_ok=True)
 
 # Настройка для статических файлов - разместите их в папке static в корне проекта
-# Создаем папку, если её нет
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static")
-os.makedirs(static_dir, exist_ok=True)
 
-# Монтируем статические файлы через маршрут /static
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+# На Vercel /static отдается напрямую из frontend (см. vercel.json), поэтому
+# StaticFiles подключаем только при локальном запуске
+if not IS_VERCEL:
+    from fastapi.staticfiles import StaticFiles
+    # Создаем папку, если её нет
+    os.makedirs(static_dir, exist_ok=True)
+    # Монтируем статические файлы через маршрут /static
+    app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 # Маршрут для отдачи главной страницы из статических файлов
 @app.get("/")
@@ -98,7 +101,7 @@ async def serve_static_index():
     # Проверяем, существует ли файл
     if os.path.exists(index_path):
         return FileResponse(index_path)
-        else:
+    else:
         # Если файла нет, возвращаем простую страницу
         return HTMLResponse("""
         <html>
@@ -130,117 +133,8 @@ async def serve_static_index():
         </html>
         """)
 
-# Регистрируем шрифты - отключаем пользовательские шрифты
-FONT_LOADED = False
-try:
-    # Отключаем загрузку пользовательских шрифтов, используем только стандартные
-    print("Используем только стандартные шрифты ReportLab")
-    # Заглушка для совместимости
-    FONT_LOADED = False
-except Exception as e:
-    print(f"Используем только стандартные шрифты: {e}")
-    FONT_LOADED = False
-
-# Определяем шрифт, который будет использоваться
-print(f"Статус загрузки шрифта: {FONT_LOADED}")
-# Отключаем загрузку пользовательских шрифтов, используем только стандартный Helvetica
-FONT_LOADED = False
-DEFAULT_FONT = "Helvetica"
-print(f"Будет использован шрифт: {DEFAULT_FONT}")
-
-# Функция для рисования школьной клетки с наклонными линиями
-def draw_school_grid(c, x, y, cell_size, rows, cols):
-    # Устанавливаем тонкие линии для сетки
-    c.setLineWidth(0.3)
-    c.setStrokeColor(Color(0.7, 0.7, 0.7))  # Светло-серый цвет для сетки
-    c.setDash([])  # Сплошная линия для клеток
-    
-    # Рисуем горизонтальные линии
-    for i in range(rows + 1):
-        c.line(x, y - i * cell_size, x + cols * cell_size, y - i * cell_size)
-    
-    # Рисуем вертикальные линии
-    for i in range(cols + 1):
-        c.line(x + i * cell_size, y, x + i * cell_size, y - rows * cell_size)
-    
-    # Не рисуем диагональные линии для соответствия образцу
-    # Диагональные линии только создают визуальный шум
-
-# Функция для рисования линейки для прописей
-def draw_propisi_lines(c, x, y, width, line_height, count, oblique=False):
-    # Настройка для рисования линий
-    c.setLineWidth(0.3)
-    
-    # Разные оттенки серого для линий прописи
-    light_gray = Color(0.85, 0.85, 0.85)  # Верхняя и нижняя линии
-    dark_gray = Color(0.6, 0.6, 0.6)      # Основная (средняя) линия
-    slope_gray = Color(0.8, 0.8, 0.8)     # Наклонные линии
-    
-    # Размер промежутков между группами линий (убираем)
-    line_gap = 0  # Полностью убираем отступы между группами линий
-    group_height = line_height * 2  # Общая высота группы из трех линий
-    
-    # Рассчитываем общее количество групп линий для заполнения всего листа
-    # Даже если count меньше, мы все равно будем заполнять весь лист
-    page_height = y
-    total_groups = int(page_height / (group_height + line_gap)) + 2  # +2 для запаса
-    
-    # Проходим по всем возможным строкам для заполнения всей страницы
-    for i in range(total_groups):
-        # Позиция для текущей группы линий (базовая линия в середине)
-        base_y = y - i * (group_height + line_gap)
-        
-        # Пропускаем, если строка уже за пределами страницы
-        if base_y - line_height < 0:
-            continue
-            
-        # Рисуем основную (среднюю) линию - более темную
-        c.setStrokeColor(dark_gray)
-        c.line(x, base_y, x + width, base_y)
-        
-        # Рисуем верхнюю линию - более светлую
-        c.setStrokeColor(light_gray)
-        c.line(x, base_y + line_height, x + width, base_y + line_height)
-        
-        # Рисуем нижнюю линию - тоже светлую
-        c.line(x, base_y - line_height, x + width, base_y - line_height)
-    
-    # Если выбрана косая линия
-    if oblique:
-        # Настройка для косых линий
-        c.setStrokeColor(slope_gray)
-        c.setLineWidth(0.25)
-
-        # Используем другой подход для рисования косых линий
-        # Угол наклона (фиксированный)
-        angle = math.radians(-58)  # направление вправо-вниз
-        
-        # Шаг между линиями (меньше для более частых линий)
-        step = 10  # пунктов
-        
-        # Подход: рисуем линии с равномерным шагом сверху и справа,
-        # убедившись, что они достаточно длинные, чтобы пройти всю страницу
-        
-        # 1. Линии начинаются сверху страницы и идут вниз вправо
-        # Используем увеличенную частоту и диапазон для гарантии покрытия всей страницы
-        extra_distance = 500  # дополнительное расстояние для гарантии пересечения всей страницы
-        
-        # Рисуем линии начиная от левой стороны до правой вверху страницы
-        for offset in range(-1000, int(width) + 1000, step):
-            # Начальная точка (с отрицательным смещением для гарантии)
-            start_x = offset
-            start_y = y + extra_distance  # Начинаем выше верха страницы
-            
-            # Рассчитываем конечную точку, достаточно далеко, чтобы пересечь страницу
-            end_y = -extra_distance  # Ниже низа страницы
-            # Используем тригонометрию для расчета смещения по X
-            delta_y = start_y - end_y
-            delta_x = delta_y * math.tan(-angle)  # Отрицательный угол для наклона вправо
-            end_x = start_x + delta_x
-            
-            # Рисуем линию
-            if offset % 2 == 0:  # Рисуем через одну линию для оптимизации
-                c.line(start_x, start_y, end_x, end_y)
+# Шрифты прописей регистрируются при первом использовании (см. fonts.py)
+print(f"Шрифт прописей по умолчанию: {DEFAULT_FONT_FAMILY}")
 
 async def root():
     return {"message": "API работает"}
@@ -270,6 +164,176 @@ async def simple_generate():
     """
     return {"status": "success", "message": "Пропись успешно сгенерирована!"}
 
+# Настройка кэша готовых PDF через переменные окружения
+pdf_cache = PdfCache(
+    max_bytes=int(os.environ.get("PDF_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    max_entries=int(os.environ.get("PDF_CACHE_MAX_ENTRIES", 512)),
+    ttl=float(os.environ.get("PDF_CACHE_TTL", 3600)),
+    disk_dir=os.path.join(temp_dir, "pdf_cache") if os.environ.get("PDF_CACHE_DISK") == "1" else None,
+    disk_max_bytes=int(os.environ.get("PDF_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024)),
+)
+
+# Временные файлы с ограничением по объему и времени жизни
+temp_storage = TempStorage(
+    temp_dir,
+    max_bytes=int(os.environ.get("TEMP_MAX_BYTES", 512 * 1024 * 1024)),
+    ttl=float(os.environ.get("TEMP_FILE_TTL", 3600)),
+)
+TEMP_SWEEP_INTERVAL = float(os.environ.get("TEMP_SWEEP_INTERVAL", 60))
+# ETag файлов хранилища; файлы живут не дольше TTL, столько же их можно держать в кэше браузера
+file_etags = FileETags()
+TEMP_CACHE_CONTROL = IMMUTABLE_CACHE_CONTROL.format(max_age=int(temp_storage.ttl))
+_sweeper_task = None
+
+# Исполнитель для рисования PDF: thread (по умолчанию), process или inline
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+render_executor = RenderExecutor(
+    kind=os.environ.get("RENDER_EXECUTOR", "thread"),
+    max_workers=RENDER_WORKERS,
+    max_pending=int(os.environ.get("RENDER_MAX_PENDING", RENDER_WORKERS * 8)),
+)
+
+def normalize_raster_options(data):
+    """
+    Формат и разрешение растрового предпросмотра или None, если нужен PDF
+    """
+    image_format = str(data.get("format") or "pdf").strip().lower()
+    if image_format not in RASTER_FORMATS:
+        return None
+    try:
+        dpi = int(data.get("dpi") or 96)
+    except (TypeError, ValueError):
+        dpi = 96
+    return image_format, max(MIN_DPI, min(MAX_DPI, dpi))
+
+# Документы больше этого размера при рендеринге сбрасываются из памяти во временный файл
+SPOOL_MAX_BYTES = int(os.environ.get("PDF_SPOOL_MAX_BYTES", 4 * 1024 * 1024))
+# Размер фрагмента при потоковой отдаче PDF
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def spooled_result(write, suffix=".pdf"):
+    """
+    Вызывает write(stream) с временным файлом, который держится в памяти только
+    до SPOOL_MAX_BYTES. Небольшой результат возвращается байтами, большой - путем
+    к файлу в temp_dir, чтобы результат можно было передать и из отдельного процесса.
+    Возвращает (содержимое или None, путь или None).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, dir=temp_dir) as spool:
+        write(spool)
+        size = spool.tell()
+        spool.seek(0)
+        if size <= SPOOL_MAX_BYTES:
+            return spool.read(), None
+        fd, path = tempfile.mkstemp(prefix="render_", suffix=suffix, dir=temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(spool, f, STREAM_CHUNK_SIZE)
+        return None, path
+
+def render_propisi_job(spec, timings=None):
+    """
+    Задача для исполнителя: рисует полный PDF (см. spooled_result)
+    """
+    return spooled_result(lambda stream: render_to(spec, stream, timings))
+
+def render_class_pack_job(spec, students, timings=None):
+    """
+    Задача для исполнителя: рисует общий PDF на весь класс (см. spooled_result)
+    """
+    return spooled_result(lambda stream: render_class_pack_to(spec, stream, students, timings))
+
+async def render_timed(fn, *args):
+    """
+    Выполняет функцию рисования в исполнителе и записывает время ее фаз
+    в метрики запроса. Если запрос профилируется, рисование идет под cProfile.
+    """
+    result, timings, report = await render_executor.run(call_with_timings, fn, args, profiling_requested())
+    record_phases(timings)
+    attach_profile(metrics_registry, report)
+    return result
+
+def write_temp_file(filepath, content):
+    """
+    Записывает готовый файл в temp_dir (выполняется в исполнителе)
+    """
+    with open(filepath, "wb") as f:
+        f.write(content)
+
+def iter_file_chunks(f, chunk_size=STREAM_CHUNK_SIZE, remove_path=None):
+    """
+    Отдает содержимое файла фрагментами и закрывает его по окончании.
+    Если указан remove_path, файл после отдачи удаляется.
+    """
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+        if remove_path:
+            try:
+                os.remove(remove_path)
+            except OSError:
+                pass
+
+async def stream_result_response(content, path, filename, media_type):
+    """
+    Отдает готовый файл потоком, фрагментами, без копирования всего документа в память.
+    Результат из временного файла (path) удаляется после отдачи.
+    """
+    if path:
+        etag = await asyncio.to_thread(file_etags.get, path)
+        result_file, size = open(path, "rb"), os.path.getsize(path)
+    else:
+        etag = content_etag(content)
+        result_file, size = io.BytesIO(content), len(content)
+    return StreamingResponse(
+        iter_file_chunks(result_file, remove_path=path),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(size),
+            "ETag": etag,
+            "Cache-Control": DIRECT_CACHE_CONTROL,
+        }
+    )
+
+async def save_result_file(content, path, prefix, extension="pdf"):
+    """
+    Сохраняет готовый результат в хранилище temp_dir и возвращает путь к нему.
+    Большой результат уже лежит на диске - его файл просто переименовывается.
+    """
+    filename = temp_storage.new_filename(prefix, extension)
+    filepath = temp_storage.path(filename)
+    if path:
+        os.replace(path, filepath)
+    else:
+        with record_phase("write"):
+            await render_executor.run(write_temp_file, filepath, content)
+        file_etags.remember(filepath, content)
+    return filepath
+
+def queue_full_response(e):
+    """
+    Ответ 503, когда исполнитель перегружен
+    """
+    print(f"Отказ в обработке: {str(e)}")
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": "Сервер перегружен, повторите запрос позже"},
+        headers={"Retry-After": "1"}
+    )
+
+def page_limit_response(e):
+    """
+    Ответ 413, когда документ не помещается в допустимое количество страниц
+    """
+    return JSONResponse(
+        status_code=413,
+        content={"status": "error", "message": str(e), "max_pages": e.max_pages}
+    )
+
 @app.post("/api/preview")
 async def generate_preview(request: Request):
     """
@@ -277,143 +341,71 @@ async def generate_preview(request: Request):
     """
     try:
         # Получаем данные из запроса
-        data = await request.json()
-        
-        # Получаем параметры или используем значения по умолчанию
-        task = data.get("task", "practice")
-        fill_type = data.get("fill_type", "first_letter")
-        text = data.get("text", "")
-        page_layout = data.get("page_layout", "lines")
-        font_type = data.get("font_type", "gray")
-        page_orientation = data.get("page_orientation", "portrait")
-        student_name = data.get("student_name", "")
-        
-        # Создаем буфер в памяти для PDF вместо создания файла
-        buffer = io.BytesIO()
+        with record_phase("parse"):
+            data = await request.json()
+        spec = WorksheetSpec.from_request(data, preview=True)
+        raster_options = normalize_raster_options(data)
         
-        # Определяем размер страницы
-        if page_orientation == "landscape":
-            pagesize = landscape(A4)
+        # Повторные запросы с теми же параметрами отдаем из кэша
+        if raster_options:
+            # Растровый предпросмотр: PNG или WebP нужного разрешения
+            image_format, dpi = raster_options
+            cache_key = make_cache_key(f"preview_{image_format}", dict(spec.as_dict(), dpi=dpi))
+            content = await pdf_cache.get_async(cache_key)
+            if content is None:
+                content = await render_timed(render_image, spec, image_format, dpi)
+                await pdf_cache.put_async(cache_key, content)
+            media_type = RASTER_FORMATS[image_format][1]
+            extension = image_format
+        elif str(data.get("format") or "").strip().lower() == "svg":
+            # Векторный предпросмотр в SVG (строится по той же сцене листа, что и PDF)
+            cache_key = make_cache_key("preview_svg", spec.as_dict())
+            content = await pdf_cache.get_async(cache_key)
+            if content is None:
+                content = await render_timed(render_svg, spec)
+                await pdf_cache.put_async(cache_key, content)
+            media_type = SVG_MEDIA_TYPE
+            extension = "svg"
         else:
-            pagesize = A4
-        
-        # Создаем PDF
-        c = canvas.Canvas(buffer, pagesize=pagesize)
-        width, height = pagesize
-        
-        # Настраиваем основной шрифт
-        c.setFont(DEFAULT_FONT, 12)
-        
-        # Добавляем метку предпросмотра
-        c.setFont(DEFAULT_FONT, 10)
-        c.setFillColor(red)
-        c.drawString(width - 150, height - 20, "ПРЕДПРОСМОТР")
-        c.setFillColor(black)
-        
-        # Добавляем заголовок
-        c.setFont(DEFAULT_FONT, 14)
-        title = "Пропись для практики письма"
-        c.drawString(30, height - 40, title)
-        
-        # Определяем отступы
-        margin_left = 30
-        margin_top = 80
-        content_width = width - 2 * margin_left
-        content_height = height - margin_top - 30
-        
-        # Рисуем разметку на странице в зависимости от выбранного типа
-        # Для предпросмотра рисуем только первую часть страницы
-        preview_height = min(300, content_height)  # Ограничиваем высоту для предпросмотра
-        
-        if page_layout == "cells":
-            # Рисуем клетки
-            cell_size = 15  # размер клетки в пунктах
-            rows = int(preview_height / cell_size)
-            cols = int(content_width / cell_size)
-            draw_school_grid(c, margin_left, height - margin_top, cell_size, rows, cols)
-        elif page_layout == "lines_oblique":
-            # Рисуем линии с наклонными линиями
-            line_height = 12  # высота строки
-            draw_propisi_lines(c, margin_left, height - margin_top, content_width, line_height, 10, True)
-        else:  # "lines"
-            # Рисуем обычные линии
-            line_height = 12  # высота строки
-            draw_propisi_lines(c, margin_left, height - margin_top, content_width, line_height, 10, False)
-        
-        # Добавляем текст прописи, если он есть
-        if text:
-            # Разбиваем текст на строки
-            lines = text.split('\n')
-            
-            # Ограничиваем количество строк для предпросмотра
-            preview_lines = lines[:5]  # Только первые 5 строк для предпросмотра
-            
-            # Определяем параметры для текста
-            c.setFont(DEFAULT_FONT, 12)
-            y_position = height - margin_top - line_height
-            
-            # Стиль шрифта в зависимости от выбранного типа
-            if font_type == "punktir":
-                c.setFillColor(Color(0.7, 0.7, 0.7))  # Светло-серый для пунктира
-            elif font_type == "gray":
-                c.setFillColor(Color(0.5, 0.5, 0.5))  # Серый
-            else:  # "black"
-                c.setFillColor(black)
-            
-            # Выводим текст в зависимости от способа заполнения
-            for i, line in enumerate(preview_lines):
-                if not line.strip():  # Пропускаем пустые строки
-                    continue
-                    
-                current_y = y_position - i * line_height * 2
-                
-                if fill_type == "first_letter":
-                    # Размножаем первую букву в каждой строке
-                    if line:
-                        first_char = line[0]
-                        c.drawString(margin_left + 5, current_y, first_char * len(line))
-                elif fill_type == "one_line":
-                    # Размножаем первую строку на всю страницу
-                    if i == 0 and line:
-                        for j in range(5):  # Только первые 5 строк для предпросмотра
-                            repeat_y = y_position - j * line_height * 2
-                            c.drawString(margin_left + 5, repeat_y, line)
-                        break  # Выводим только первую строку
-                else:  # "all"
-                    # Выводим текст как есть
-                    c.drawString(margin_left + 5, current_y, line)
-        
-        # Сохраняем PDF в буфер
-        c.save()
-        
-        # Получаем содержимое буфера
-        buffer.seek(0)
+            cache_key = make_cache_key("preview", spec.as_dict())
+            content = await pdf_cache.get_async(cache_key)
+            if content is None:
+                content = await render_timed(render, spec)
+                await pdf_cache.put_async(cache_key, content)
+            media_type = "application/pdf"
+            extension = "pdf"
         
         # Проверяем, работаем ли на Vercel
         is_vercel = os.environ.get('VERCEL', False)
         
         if is_vercel:
-            # На Vercel возвращаем PDF напрямую
+            # На Vercel возвращаем предпросмотр напрямую
             return Response(
-                content=buffer.read(),
-                media_type="application/pdf",
-                headers={"Content-Disposition": "inline; filename=preview.pdf"}
+                content=content,
+                media_type=media_type,
+                headers={
+                    "Content-Disposition": f"inline; filename=preview.{extension}",
+                    "ETag": content_etag(content),
+                    "Cache-Control": DIRECT_CACHE_CONTROL,
+                }
             )
         else:
             # В локальной среде сохраняем файл как раньше
             # Создаем уникальное имя файла
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            filename = f"preview_{timestamp}.pdf"
-            filepath = os.path.join(temp_dir, filename)
+            filename = temp_storage.new_filename("preview", extension)
+            filepath = temp_storage.path(filename)
             
-            # Сохраняем буфер в файл
-            with open(filepath, "wb") as f:
-                f.write(buffer.getvalue())
+            # Сохраняем предпросмотр в файл
+            with record_phase("write"):
+                await render_executor.run(write_temp_file, filepath, content)
+            file_etags.remember(filepath, content)
             
             # Формируем URL для просмотра
             preview_url = f"/preview/{filename}"
             
             return {"status": "success", "message": "Предпросмотр создан успешно", "preview_url": preview_url}
+    except RenderQueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         print(f"Ошибка в /api/preview: {str(e)}")
         # Более подробная обработка ошибок
@@ -427,36 +419,173 @@ async def generate_preview(request: Request):
             content={"status": "error", "message": error_message, "error_details": str(e)}
         )
 
+async def wait_debounced(changed, delay):
+    """
+    Ждет изменения параметров, а затем паузы в delay секунд без новых изменений
+    """
+    await changed.wait()
+    while True:
+        changed.clear()
+        try:
+            await asyncio.wait_for(changed.wait(), delay)
+        except asyncio.TimeoutError:
+            return
+
+async def render_live_preview(session):
+    """
+    Рисует предпросмотр сессии. Сессия хранит готовые слои в памяти сервера,
+    поэтому при исполнителе process она рисует в потоке, а не в другом процессе.
+    """
+    if render_executor.kind == "process":
+        return await asyncio.to_thread(session.render)
+    return await render_executor.run(session.render)
+
+# Открытые сессии живого предпросмотра (меняется только из цикла событий)
+live_preview_sessions = 0
+
+@app.websocket("/ws/preview")
+async def live_preview(websocket: WebSocket):
+    """
+    Живой предпросмотр: клиент присылает изменения параметров (JSON), сервер
+    после паузы в изменениях отвечает сообщением JSON со сведениями и затем
+    двоичным сообщением с предпросмотром
+    """
+    global live_preview_sessions
+    await websocket.accept()
+    if live_preview_sessions >= LIVE_PREVIEW_MAX_SESSIONS:
+        # 1013 - "повторите позже"
+        await websocket.send_json({"status": "error", "message": "Слишком много открытых предпросмотров, повторите позже"})
+        await websocket.close(code=1013)
+        return
+    live_preview_sessions += 1
+    session = LivePreviewSession()
+    changed = asyncio.Event()
+
+    async def receive_changes():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            # Двоичные сообщения не принимаем, но сессию не закрываем
+            message = message.get("text")
+            if message is None:
+                await websocket.send_json({"status": "error", "message": "Ожидается текстовое сообщение с объектом JSON"})
+                continue
+            try:
+                session.update(json.loads(message))
+            except json.JSONDecodeError:
+                await websocket.send_json({"status": "error", "message": "Сообщение должно быть объектом JSON"})
+                continue
+            except ValueError as e:
+                await websocket.send_json({"status": "error", "message": str(e)})
+                continue
+            changed.set()
+
+    receiver = asyncio.create_task(receive_changes())
+    backoff = None
+    try:
+        while True:
+            debounce = asyncio.create_task(wait_debounced(changed, LIVE_PREVIEW_DEBOUNCE))
+            await asyncio.wait((receiver, debounce), return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                debounce.cancel()
+                # Отключение клиента - обычное завершение сессии
+                error = receiver.exception()
+                if not isinstance(error, WebSocketDisconnect):
+                    print(f"Ошибка в /ws/preview: {str(error)}")
+                break
+            try:
+                info, content = await render_live_preview(session)
+            except RenderQueueFull:
+                # Сообщаем о перегрузке один раз и повторяем позже, с растущей паузой;
+                # изменения клиента за это время сохраняются в сессии
+                if backoff is None:
+                    backoff = LIVE_PREVIEW_BACKOFF
+                    await websocket.send_json({
+                        "status": "busy",
+                        "message": "Сервер перегружен, предпросмотр будет обновлен позже",
+                        "retry_after_ms": round(backoff * 1000),
+                    })
+                else:
+                    backoff = min(backoff * 2, LIVE_PREVIEW_MAX_BACKOFF)
+                await asyncio.wait((receiver,), timeout=backoff)
+                changed.set()
+                continue
+            except Exception as e:
+                print(f"Ошибка в /ws/preview: {str(e)}")
+                await websocket.send_json({"status": "error", "message": f"Произошла ошибка: {str(e)}"})
+                continue
+            backoff = None
+            await websocket.send_json(info)
+            if content is not None:
+                await websocket.send_bytes(content)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        live_preview_sessions -= 1
+
 # Добавляем маршрут для просмотра предпросмотра
 @app.get("/preview/{filename}")
-async def view_preview(filename: str):
+async def view_preview(filename: str, request: Request):
     """
     Маршрут для просмотра предпросмотра
     """
-    file_path = os.path.join(temp_dir, filename)
+    try:
+        file_path = temp_storage.path(filename)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Файл не найден")
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Файл не найден")
+    
+    # Файл у клиента уже есть - отвечаем 304 без чтения файла
+    etag = await asyncio.to_thread(file_etags.get, file_path)
+    unchanged = not_modified(request, etag, TEMP_CACHE_CONTROL)
+    if unchanged:
+        return unchanged
+    
+    # Предпросмотр может быть PDF или изображением
+    media_type = "application/pdf"
+    for image_format, (_, image_media_type) in RASTER_FORMATS.items():
+        if filename.endswith(f".{image_format}"):
+            media_type = image_media_type
+    if filename.endswith(".svg"):
+        media_type = SVG_MEDIA_TYPE
         
     return FileResponse(
         path=file_path, 
         filename=filename,
-        media_type="application/pdf"
+        media_type=media_type,
+        headers={"ETag": etag, "Cache-Control": TEMP_CACHE_CONTROL}
     )
 
 # Добавляем маршрут для скачивания файлов
 @app.get("/download/{filename}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request):
     """
     Маршрут для скачивания сгенерированных файлов
     """
-    file_path = os.path.join(temp_dir, filename)
+    try:
+        file_path = temp_storage.path(filename)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Файл не найден")
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Файл не найден")
     
+    # Файл у клиента уже есть - отвечаем 304 без чтения файла
+    etag = await asyncio.to_thread(file_etags.get, file_path)
+    unchanged = not_modified(request, etag, TEMP_CACHE_CONTROL)
+    if unchanged:
+        return unchanged
+    
+    # Пакеты для класса могут быть ZIP-архивами
+    media_type = "application/zip" if filename.endswith(".zip") else "application/pdf"
+    
     return FileResponse(
         path=file_path, 
         filename=filename,
-        media_type="application/pdf"
+        media_type=media_type,
+        headers={"ETag": etag, "Cache-Control": TEMP_CACHE_CONTROL}
     )
 
 @app.post("/api/generate-pdf")
@@ -466,180 +595,522 @@ async def generate_pdf(request: Request):
     """
     try:
         # Получаем данные из запроса
-        data = await request.json()
+        with record_phase("parse"):
+            data = await request.json()
+        spec = WorksheetSpec.from_request(data)
         
-        # Получаем параметры или используем значения по умолчанию
-        task = data.get("task", "practice")
-        fill_type = data.get("fill_type", "first_letter")
-        text = data.get("text", "")
-        page_layout = data.get("page_layout", "lines")
-        font_type = data.get("font_type", "gray")
-        page_orientation = data.get("page_orientation", "portrait")
-        student_name = data.get("student_name", "")
+        # Повторные запросы с теми же параметрами отдаем из кэша
+        cache_key = make_cache_key("pdf", spec.as_dict())
+        pdf_bytes = await pdf_cache.get_async(cache_key)
+        pdf_path = None
+        if pdf_bytes is None:
+            # Рисуем в исполнителе, чтобы не блокировать цикл событий
+            pdf_bytes, pdf_path = await render_timed(render_propisi_job, spec)
+            # Большие документы приходят файлом и в кэш не попадают
+            if pdf_bytes is not None:
+                await pdf_cache.put_async(cache_key, pdf_bytes)
         
-        # Создаем буфер в памяти для PDF вместо создания файла
-        buffer = io.BytesIO()
-        
-        # Определяем размер страницы
-        if page_orientation == "landscape":
-            pagesize = landscape(A4)
-            else:
-            pagesize = A4
-        
-        # Создаем PDF
-        c = canvas.Canvas(buffer, pagesize=pagesize)
-        width, height = pagesize
-        
-        # Настраиваем основной шрифт
-        c.setFont(DEFAULT_FONT, 12)
+        # Проверяем, работаем ли на Vercel
+        is_vercel = os.environ.get('VERCEL', False)
         
-        # Добавляем дату в углу
-        c.setFont(DEFAULT_FONT, 8)
-        today = datetime.datetime.now().strftime("%d.%m.%Y")
-        c.drawRightString(width - 20, height - 20, f"Дата: {today}")
+        if is_vercel or data.get("stream"):
+            # Имя файла и ETag зависят только от параметров листа
+            filename = f"propisi_{spec.file_stamp()}.pdf"
+            return await stream_result_response(pdf_bytes, pdf_path, filename, "application/pdf")
+        else:
+            # В локальной среде сохраняем файл как раньше
+            filepath = await save_result_file(pdf_bytes, pdf_path, "propisi")
+            
+            # Формируем URL для скачивания
+            file_url = f"/download/{os.path.basename(filepath)}"
+            
+            return {
+                "status": "success",
+                "message": "Пропись успешно сгенерирована",
+                "file_url": file_url,
+                "output_profile": spec.output_profile,
+                "size_bytes": os.path.getsize(filepath),
+            }
+    except RenderQueueFull as e:
+        return queue_full_response(e)
+    except PageLimitExceeded as e:
+        return page_limit_response(e)
+    except Exception as e:
+        print(f"Ошибка в /api/generate-pdf: {str(e)}")
+        # Более подробная обработка ошибок для отладки
+        error_type = type(e).__name__
+        error_message = f"Произошла ошибка типа {error_type}: {str(e)}"
+        print(error_message)
+        import traceback
+        print(traceback.format_exc())  # Для отладки выводим полный стек вызовов
         
-        # Добавляем заголовок
-        c.setFont(DEFAULT_FONT, 14)
-        title = "Пропись для практики письма"
-        c.drawString(30, height - 40, title)
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": error_message, "error_details": str(e), "error_type": error_type}
+        )
+
+# Ограничение на количество учеников в одном пакете
+BATCH_MAX_STUDENTS = int(os.environ.get("BATCH_MAX_STUDENTS", 100))
+# Количество процессов для пакетной генерации (0 - генерировать в текущем процессе)
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 0 if os.environ.get('VERCEL', False) else (os.cpu_count() or 1)))
+
+_batch_pool = None
+
+def get_batch_pool():
+    """
+    Пул процессов для пакетной генерации, создается при первом обращении
+    """
+    global _batch_pool
+    if _batch_pool is None and BATCH_WORKERS > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _batch_pool
+
+def normalize_students(data):
+    """
+    Список учеников пакета: строки с именами или объекты {"name", "text"}
+    """
+    students = []
+    for item in data.get("students") or data.get("student_names") or []:
+        if isinstance(item, dict):
+            name = str(item.get("name") or "").strip()
+            text = item.get("text")
+        else:
+            name = str(item or "").strip()
+            text = None
+        if name:
+            students.append({"name": name, "text": str(text) if text else None})
+    return students
+
+def too_many_students_response():
+    """
+    Ответ 400, когда в пакете больше BATCH_MAX_STUDENTS учеников
+    """
+    return JSONResponse(
+        status_code=400,
+        content={"status": "error", "message": f"Слишком много учеников: не более {BATCH_MAX_STUDENTS}"}
+    )
+
+def student_pdf_filename(index, name):
+    """
+    Имя файла ученика внутри ZIP: порядковый номер и имя без служебных символов
+    """
+    safe_name = "".join(ch if ch.isalnum() else "_" for ch in name).strip("_")
+    return f"{index:02d}_{safe_name or 'student'}.pdf"
+
+def iter_student_pdfs(spec, chunk, timings=None):
+    """
+    Отдельные PDF учеников по одному: (имя файла в ZIP, содержимое)
+    """
+    for index, student in chunk:
+        yield student_pdf_filename(index, student["name"]), render(spec.for_student(student["name"], student["text"]), timings)
+
+def render_students_chunk(spec, chunk):
+    """
+    Рисует отдельные PDF для части учеников (выполняется в процессе пула)
+    """
+    return list(iter_student_pdfs(spec, chunk))
+
+def write_students_zip(stream, files):
+    """
+    Складывает PDF учеников в ZIP. PDF уже сжаты, поэтому без повторного сжатия.
+    """
+    import zipfile
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+        for filename, pdf_bytes in files:
+            archive.writestr(filename, pdf_bytes)
+
+def render_class_pack_zip_job(spec, indexed, timings=None):
+    """
+    Задача для исполнителя: рисует PDF учеников и сразу складывает их в ZIP,
+    не держа все документы в памяти (см. spooled_result)
+    """
+    return spooled_result(lambda stream: write_students_zip(stream, iter_student_pdfs(spec, indexed, timings)), ".zip")
+
+def build_class_pack_zip(results):
+    """
+    Задача для исполнителя: ZIP из готовых частей пакета (см. spooled_result)
+    """
+    return spooled_result(lambda stream: write_students_zip(stream, (item for chunk in results for item in chunk)), ".zip")
+
+async def render_class_pack_zip(spec, students):
+    """
+    ZIP с отдельным PDF для каждого ученика: (содержимое или None, путь или None).
+    Без пула пакетной генерации весь архив собирается одной задачей исполнителя.
+    С пулом ученики делятся на части, которые рисуются параллельно в его процессах;
+    части учитываются в очереди исполнителя, и архив тоже собирается в исполнителе.
+    """
+    indexed = list(enumerate(students, start=1))
+    pool = get_batch_pool()
+    if pool is None:
+        return await render_timed(render_class_pack_zip_job, spec, indexed)
+    
+    chunk_count = min(BATCH_WORKERS, render_executor.max_pending)
+    chunk_size = -(-len(indexed) // chunk_count)
+    chunks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+    results = await render_executor.map_in_pool(pool, render_students_chunk, [(spec, chunk) for chunk in chunks])
+    with record_phase("write"):
+        return await render_executor.run(build_class_pack_zip, results)
+
+@app.post("/api/generate-batch")
+async def generate_batch(request: Request):
+    """
+    API для генерации прописей на весь класс: один PDF на всех или ZIP с PDF для каждого ученика
+    """
+    try:
+        # Получаем данные из запроса
+        with record_phase("parse"):
+            data = await request.json()
+        spec = WorksheetSpec.from_request(data)
+        students = normalize_students(data)
+        output = data.get("output", "merged")
         
-        # Если указано имя ученика, добавляем его
-        if student_name:
-            c.setFont(DEFAULT_FONT, 12)
-            c.drawString(30, height - 60, f"Ученик: {student_name}")
+        if not students:
+            return JSONResponse(
+                status_code=400,
+                content={"status": "error", "message": "Не указан список учеников"}
+            )
+        if len(students) > BATCH_MAX_STUDENTS:
+            return too_many_students_response()
         
-        # Определяем отступы
-        margin_left = 30
-        margin_top = 80
-        content_width = width - 2 * margin_left
-        content_height = height - margin_top - 30
+        if output == "zip":
+            content, path = await render_class_pack_zip(spec, students)
+            media_type = "application/zip"
+            extension = "zip"
+        else:
+            # Общий PDF рисуется во временный файл: страниц может быть много
+            content, path = await render_timed(render_class_pack_job, spec, students)
+            media_type = "application/pdf"
+            extension = "pdf"
         
-        # Рисуем разметку на странице в зависимости от выбранного типа
-        if page_layout == "cells":
-            # Рисуем клетки
-            cell_size = 15  # размер клетки в пунктах
-            rows = int(content_height / cell_size)
-            cols = int(content_width / cell_size)
-            draw_school_grid(c, margin_left, height - margin_top, cell_size, rows, cols)
-        elif page_layout == "lines_oblique":
-            # Рисуем линии с наклонными линиями
-            line_height = 12  # высота строки
-            draw_propisi_lines(c, margin_left, height - margin_top, content_width, line_height, 20, True)
-        else:  # "lines"
-            # Рисуем обычные линии
-            line_height = 12  # высота строки
-            draw_propisi_lines(c, margin_left, height - margin_top, content_width, line_height, 20, False)
+        # Проверяем, работаем ли на Vercel
+        is_vercel = os.environ.get('VERCEL', False)
         
-        # Добавляем текст прописи, если он есть
-        if text:
-            # Разбиваем текст на строки
-            lines = text.split('\n')
-            
-            # Определяем параметры для текста
-            c.setFont(DEFAULT_FONT, 12)
-            y_position = height - margin_top - line_height
+        if is_vercel:
+            # На Vercel отдаем файл напрямую
+            filename = f"propisi_class_{spec.file_stamp()}.{extension}"
+            return await stream_result_response(content, path, filename, media_type)
+        else:
+            # В локальной среде сохраняем файл и возвращаем ссылку для скачивания
+            filepath = await save_result_file(content, path, "propisi_class", extension)
             
-            # Стиль шрифта в зависимости от выбранного типа
-            if font_type == "punktir":
-                c.setFillColor(Color(0.7, 0.7, 0.7))  # Светло-серый для пунктира
-            elif font_type == "gray":
-                c.setFillColor(Color(0.5, 0.5, 0.5))  # Серый
-            else:  # "black"
-                c.setFillColor(black)
+            file_url = f"/download/{os.path.basename(filepath)}"
             
-            # Выводим текст в зависимости от способа заполнения
-            for i, line in enumerate(lines):
-                if not line.strip():  # Пропускаем пустые строки
-                    continue
-                    
-                current_y = y_position - i * line_height * 2
-                
-                # Прерываем, если вышли за пределы страницы
-                if current_y < 30:
-                    break
-                
-                if fill_type == "first_letter":
-                    # Размножаем первую букву в каждой строке
-                    if line:
-                        first_char = line[0]
-                        c.drawString(margin_left + 5, current_y, first_char * len(line))
-                elif fill_type == "one_line":
-                    # Размножаем первую строку на всю страницу
-                    if i == 0 and line:
-                        for j in range(20):  # Максимум 20 строк
-                            repeat_y = y_position - j * line_height * 2
-                            if repeat_y < 30:
-                                break
-                            c.drawString(margin_left + 5, repeat_y, line)
-                        break  # Выводим только первую строку
-                else:  # "all"
-                    # Выводим текст как есть
-                    c.drawString(margin_left + 5, current_y, line)
+            return {"status": "success", "message": "Прописи для класса успешно сгенерированы", "file_url": file_url, "students": len(students)}
+    except RenderQueueFull as e:
+        return queue_full_response(e)
+    except PageLimitExceeded as e:
+        return page_limit_response(e)
+    except Exception as e:
+        print(f"Ошибка в /api/generate-batch: {str(e)}")
+        error_type = type(e).__name__
+        error_message = f"Произошла ошибка типа {error_type}: {str(e)}"
+        import traceback
+        print(traceback.format_exc())  # Для отладки выводим полный стек вызовов
         
-        # Сохраняем PDF в буфер
-        c.save()
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": error_message, "error_details": str(e), "error_type": error_type}
+        )
+
+@app.post("/api/generate-nup")
+async def generate_nup(request: Request):
+    """
+    API для листа из нескольких упражнений (N-up): список blocks, у каждого
+    блока свой текст, заполнение и линовка; per_page (2, 4, 6, 8) делит лист
+    на равные ячейки, иначе блоки укладываются по высоте их текста
+    """
+    try:
+        with record_phase("parse"):
+            data = await request.json()
+        try:
+            spec = NupSpec.from_request(data)
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content={"status": "error", "message": str(e)}
+            )
         
-        # Получаем содержимое буфера
-        buffer.seek(0)
+        if not spec.blocks:
+            return JSONResponse(
+                status_code=400,
+                content={"status": "error", "message": "Не указан список упражнений"}
+            )
+        
+        # Повторные запросы с теми же параметрами отдаем из кэша
+        cache_key = make_cache_key("nup", spec.as_dict())
+        content = await pdf_cache.get_async(cache_key)
+        if content is None:
+            content = await render_timed(render_nup, spec)
+            await pdf_cache.put_async(cache_key, content)
         
         # Проверяем, работаем ли на Vercel
         is_vercel = os.environ.get('VERCEL', False)
         
         if is_vercel:
-            # На Vercel возвращаем PDF напрямую
-            filename = f"propisi_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+            filename = f"propisi_nup_{spec.page.file_stamp()}.pdf"
+            # На Vercel возвращаем файл напрямую
             return Response(
-                content=buffer.read(),
+                content=content,
                 media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
+                headers={
+                    "Content-Disposition": f"attachment; filename={filename}",
+                    "ETag": content_etag(content),
+                    "Cache-Control": DIRECT_CACHE_CONTROL,
+                }
             )
         else:
-            # В локальной среде сохраняем файл как раньше
-            # Создаем уникальное имя файла
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            filename = f"propisi_{timestamp}.pdf"
-            filepath = os.path.join(temp_dir, filename)
-            
-            # Сохраняем буфер в файл
-            with open(filepath, "wb") as f:
-                f.write(buffer.getvalue())
+            # В локальной среде сохраняем файл и возвращаем ссылку для скачивания
+            filename = temp_storage.new_filename("propisi_nup")
+            filepath = temp_storage.path(filename)
+            with record_phase("write"):
+                await render_executor.run(write_temp_file, filepath, content)
+            file_etags.remember(filepath, content)
             
-            # Формируем URL для скачивания
-            file_url = f"/download/{filename}"
-            
-            return {"status": "success", "message": "Пропись успешно сгенерирована", "file_url": file_url}
+            return {"status": "success", "message": "Лист упражнений успешно сгенерирован", "file_url": f"/download/{filename}", "blocks": len(spec.blocks)}
+    except RenderQueueFull as e:
+        return queue_full_response(e)
+    except PageLimitExceeded as e:
+        return page_limit_response(e)
     except Exception as e:
-        print(f"Ошибка в /api/generate-pdf: {str(e)}")
-        # Более подробная обработка ошибок для отладки
+        print(f"Ошибка в /api/generate-nup: {str(e)}")
         error_type = type(e).__name__
-        error_message = f"Произошла ошибка типа {error_type}: {str(e)}"
-        print(error_message)
         import traceback
         print(traceback.format_exc())  # Для отладки выводим полный стек вызовов
         
         return JSONResponse(
             status_code=500,
-            content={"status": "error", "message": error_message, "error_details": str(e), "error_type": error_type}
+            content={"status": "error", "message": f"Произошла ошибка типа {error_type}: {str(e)}", "error_type": error_type}
+        )
+
+def render_job_file(payload, filepath):
+    """
+    Рисует PDF фоновой задачи сразу в файл, не держа документ в памяти.
+    Документ пишется под временным именем и появляется под именем filepath
+    только целиком: после ошибки не остается обрезанного файла.
+    """
+    fd, partial_path = tempfile.mkstemp(prefix="render_", suffix=".pdf", dir=os.path.dirname(filepath))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if payload["students"]:
+                pages = render_class_pack_to(payload["spec"], f, payload["students"])
+            else:
+                pages = render_to(payload["spec"], f)
+        os.replace(partial_path, filepath)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    return pages
+
+# Пауза перед повторной попыткой, если исполнитель рисования занят, секунды
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 0.5))
+
+async def run_render_job(payload):
+    """
+    Выполняет фоновую задачу: рисует PDF в temp_dir через исполнитель.
+    Если очередь исполнителя заполнена запросами, задача ждет места и не завершается ошибкой.
+    """
+    filename = temp_storage.new_filename("propisi_job")
+    filepath = temp_storage.path(filename)
+    while True:
+        try:
+            pages = await render_executor.run(render_job_file, payload, filepath)
+            break
+        except RenderQueueFull:
+            await asyncio.sleep(JOB_RETRY_DELAY)
+    return {"file_url": f"/download/{filename}", "pages": pages}
+
+# Очередь фоновых задач генерации
+job_queue = LocalJobQueue(
+    run_render_job,
+    workers=int(os.environ.get("JOB_WORKERS", 2)),
+    max_queued=int(os.environ.get("JOB_MAX_QUEUED", 100)),
+    ttl=float(os.environ.get("JOB_TTL", 3600)),
+)
+
+def job_response(job):
+    """
+    Описание задачи для клиента
+    """
+    result = job["result"] or {}
+    return {
+        "job_id": job["id"],
+        "state": job["state"],
+        "status_url": f"/api/jobs/{job['id']}",
+        "file_url": result.get("file_url"),
+        "pages": result.get("pages"),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+@app.post("/api/jobs")
+async def create_job(request: Request):
+    """
+    API для фоновой генерации PDF: сразу возвращает идентификатор задачи.
+    Принимает те же параметры, что и /api/generate-pdf; если передан список
+    students, рисуется общий PDF на весь класс.
+    """
+    try:
+        with record_phase("parse"):
+            data = await request.json()
+        students = normalize_students(data)
+        if len(students) > BATCH_MAX_STUDENTS:
+            return too_many_students_response()
+        payload = {
+            "spec": WorksheetSpec.from_request(data),
+            "students": students,
+        }
+        job = job_queue.submit(payload)
+        return JSONResponse(status_code=202, content={"status": "success", **job_response(job)})
+    except JobQueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        print(f"Ошибка в /api/jobs: {str(e)}")
+        error_type = type(e).__name__
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": f"Произошла ошибка типа {error_type}: {str(e)}", "error_type": error_type}
+        )
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Состояние фоновой задачи; после завершения - ссылка на файл
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return {"status": "success", **job_response(job)}
+
+# Занятое место во временной директории
+@app.get("/api/storage-stats")
+async def storage_stats():
+    """
+    Объем временных файлов и статистика их очистки
+    """
+    # Обход temp_dir может быть долгим, поэтому не в цикле событий
+    return {"status": "ok", "storage": await asyncio.to_thread(temp_storage.usage)}
+
+# Статистика кэша PDF
+@app.get("/api/cache-stats")
+async def cache_stats():
+    """
+    Попадания, промахи и объем данных в кэше PDF
+    """
+    return {"status": "ok", "cache": pdf_cache.stats()}
+
+# Размер PDF в разных профилях вывода
+@app.post("/api/size-report")
+async def size_report(request: Request):
+    """
+    Рисует лист во всех профилях вывода и возвращает размер каждого варианта
+    с разбивкой: шрифты, страницы, формы, изображения и служебные данные
+    """
+    try:
+        data = await request.json()
+        spec = WorksheetSpec.from_request(data, preview=bool(data.get("preview")))
+        profiles = await render_executor.run(render_size_report, spec)
+        return {"status": "success", "profiles": profiles}
+    except RenderQueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        print(f"Ошибка в /api/size-report: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": f"Произошла ошибка: {str(e)}"}
         )
 
+# Метрики в формате Prometheus
+@app.get("/metrics")
+async def metrics():
+    """
+    Задержки и фазы запросов по маршрутам, коды ответов, а также состояние
+    кэша, исполнителя и очереди задач
+    """
+    cache = pdf_cache.stats()
+    executor = render_executor.stats()
+    jobs = job_queue.stats()
+    gauges = {
+        "propisi_cache_hits": ("Попадания в кэш PDF", cache["hits"] + cache["disk_hits"]),
+        "propisi_cache_misses": ("Промахи кэша PDF", cache["misses"]),
+        "propisi_cache_bytes": ("Объем кэша PDF в памяти", cache["bytes"]),
+        "propisi_cache_entries": ("Записей в кэше PDF", cache["entries"]),
+        "propisi_render_pending": ("Задач рисования в исполнителе", executor["pending"]),
+        "propisi_render_completed": ("Выполнено задач рисования", executor["completed"]),
+        "propisi_render_rejected": ("Отклонено задач рисования", executor["rejected"]),
+        "propisi_render_busy_seconds": ("Суммарное время задач рисования", executor["busy_seconds"]),
+        "propisi_jobs_queued": ("Фоновых задач в очереди", jobs["queued"]),
+    }
+    return PlainTextResponse(metrics_registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+# Отчеты профилировщика для запросов с заголовком X-Profile
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """
+    Отчет cProfile по идентификатору из заголовка X-Profile-Id
+    """
+    report = metrics_registry.get_profile(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Отчет не найден")
+    return PlainTextResponse(report)
+
 # Добавим простой маршрут для проверки, что функция работает без работы с PDF
 @app.get("/api/debug-status")
 async def debug_status():
     """
     Простой маршрут для проверки работоспособности API
     """
-    # Собираем информацию об окружении
+    # Собираем информацию об окружении; обход temp_dir - не в цикле событий
+    storage_usage = await asyncio.to_thread(temp_storage.usage)
     env_info = {
         "is_vercel": os.environ.get('VERCEL', False),
         "temp_dir": temp_dir,
         "temp_dir_exists": os.path.exists(temp_dir),
         "temp_dir_writable": os.access(temp_dir, os.W_OK) if os.path.exists(temp_dir) else False,
         "python_version": ".".join(map(str, sys.version_info[:3])),
-        "reportlab_version": getattr(canvas, "__version__", "unknown")
+        "reportlab_version": getattr(canvas, "__version__", "unknown"),
+        "pdf_cache": pdf_cache.stats(),
+        "render_executor": render_executor.stats(),
+        "jobs": job_queue.stats(),
+        "live_preview_sessions": live_preview_sessions,
+        "temp_storage": storage_usage
     }
     
     return {"status": "ok", "message": "API работает", "env_info": env_info}
 
+def render_simplified_preview(temp_dir):
+    """
+    Минимальный тестовый PDF для проверки работы на Vercel
+    """
+    # Создаем буфер в памяти для PDF
+    buffer = io.BytesIO()
+    
+    # Создаем простой PDF
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    
+    # Рисуем простой текст
+    c.setFont("Helvetica", 16)
+    c.drawString(100, height - 100, "Тестовый PDF")
+    c.setFont("Helvetica", 12)
+    c.drawString(100, height - 120, "Тестовая строка для проверки работы на Vercel")
+    
+    # Добавляем текущую дату и время
+    c.drawString(100, height - 140, f"Дата и время: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    
+    # Добавляем информацию об окружении
+    c.drawString(100, height - 160, f"Vercel: {os.environ.get('VERCEL', False)}")
+    c.drawString(100, height - 180, f"Temp dir: {temp_dir}")
+    
+    # Сохраняем PDF в буфер
+    c.save()
+    return buffer.getvalue()
+
 # Упрощенная функция для генерации PDF без использования файловой системы
 @app.post("/api/simplified-preview")
 async def simplified_preview(request: Request):
@@ -647,38 +1118,17 @@ async def simplified_preview(request: Request):
     Упрощенная версия API для предпросмотра - минимальный PDF
     """
     try:
-        # Создаем буфер в памяти для PDF
-        buffer = io.BytesIO()
-        
-        # Создаем простой PDF
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        # Рисуем простой текст
-        c.setFont("Helvetica", 16)
-        c.drawString(100, height - 100, "Тестовый PDF")
-        c.setFont("Helvetica", 12)
-        c.drawString(100, height - 120, "Тестовая строка для проверки работы на Vercel")
-        
-        # Добавляем текущую дату и время
-        c.drawString(100, height - 140, f"Дата и время: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # Добавляем информацию об окружении
-        c.drawString(100, height - 160, f"Vercel: {os.environ.get('VERCEL', False)}")
-        c.drawString(100, height - 180, f"Temp dir: {temp_dir}")
+        # Рисуем PDF в исполнителе, чтобы не блокировать цикл событий
+        pdf_bytes = await render_executor.run(render_simplified_preview, temp_dir)
         
-        # Сохраняем PDF в буфер
-    c.save()
-    
-        # Получаем содержимое буфера
-        buffer.seek(0)
-    
         # Возвращаем PDF напрямую
         return Response(
-            content=buffer.read(),
-        media_type="application/pdf", 
+            content=pdf_bytes,
+            media_type="application/pdf", 
             headers={"Content-Disposition": "inline; filename=test.pdf"}
         )
+    except RenderQueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         # Подробная информация об ошибке
         error_type = type(e).__name__
@@ -699,30 +1149,40 @@ async def simplified_preview(request: Request):
             }
         )
 
+# Заранее готовить шаблоны разметки и шрифты при запуске (на Vercel по умолчанию
+# выключено: там важнее быстрый холодный старт, шаблоны рисуются при первом запросе)
+WARM_ON_STARTUP = os.environ.get("WARM_ON_STARTUP", "0" if IS_VERCEL else "1") == "1"
+
+# Рисуем шаблоны разметки один раз при запуске сервера
+@app.on_event("startup")
+async def startup_event():
+    if WARM_ON_STARTUP:
+        count = warm_ruling_templates()
+        print(f"Подготовлено шаблонов разметки: {count}")
+        print(f"Зарегистрированы шрифты: {', '.join(font_registry.warm())}")
+    # Запускаем обработчики фоновых задач
+    await job_queue.start()
+    # Запускаем фоновую очистку временных файлов
+    global _sweeper_task
+    _sweeper_task = asyncio.create_task(temp_storage.run_sweeper(TEMP_SWEEP_INTERVAL))
+
 # Удаление временных файлов при выключении сервера
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
+    # Останавливаем очистку, фоновые задачи, пулы рисования и пакетной генерации
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+    await job_queue.shutdown()
+    render_executor.shutdown()
+    if _batch_pool is not None:
+        _batch_pool.shutdown(wait=False, cancel_futures=True)
+    
     # Не удаляем системную /tmp директорию
     if temp_dir != "/tmp":
-    shutil.rmtree(temp_dir, ignore_errors=True)
+        shutil.rmtree(temp_dir, ignore_errors=True)
     else:
-        # Удаляем только наши файлы в /tmp
-        import glob
-        for f in glob.glob(os.path.join(temp_dir, "propisi_*.pdf")):
-            try:
-                os.remove(f)
-            except:
-                pass
-        for f in glob.glob(os.path.join(temp_dir, "preview_*.pdf")):
-            try:
-                os.remove(f)
-            except:
-                pass
-        for f in glob.glob(os.path.join(temp_dir, "preview_*.png")):
-            try:
-                os.remove(f)
-            except:
-                pass
+        # Удаляем только файлы хранилища в /tmp (см. storage.MANAGED_PREFIXES)
+        await asyncio.to_thread(temp_storage.clear)
 
 # Специальные настройки для Vercel
 if os.environ.get('VERCEL', False):
@@ -0,0 +1,275 @@
+"""
+Метрики запросов в формате Prometheus и профилирование по заголовку.
+
+MetricsMiddleware измеряет каждый HTTP-запрос: задержку по маршруту,
+количество ответов по кодам, ошибки и объем отданных данных. Внутри
+обработчика время отдельных фаз (разбор JSON, разметка, текст, сохранение
+PDF, запись на диск) записывается через record_phase/record_phases.
+
+Если задана переменная PROFILING_TOKEN, запрос с заголовком
+X-Profile: <токен> рисуется под cProfile; отчет доступен по идентификатору
+из заголовка ответа X-Profile-Id.
+"""
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Сколько последних отчетов профилировщика хранить в памяти
+PROFILE_KEEP = 20
+# Сколько строк отчета pstats выводить
+PROFILE_LINES = 40
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами (накопительная, как в Prometheus)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """
+    Хранилище метрик процесса. Все изменения под блокировкой: метрики
+    пишутся и из цикла событий, и из потоков исполнителя.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # (route, method) -> Histogram
+        self.phases = {}  # (route, phase) -> Histogram
+        self.requests = {}  # (route, method, status) -> количество
+        self.errors = {}  # route -> количество
+        self.response_bytes = {}  # route -> байт
+        self._profiles = OrderedDict()
+
+    def observe_request(self, route, method, status, seconds, body_bytes, phases):
+        with self._lock:
+            self.latency.setdefault((route, method), Histogram()).observe(seconds)
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.response_bytes[route] = self.response_bytes.get(route, 0) + body_bytes
+            if status >= 500:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            for phase, phase_seconds in phases.items():
+                self.phases.setdefault((route, phase), Histogram()).observe(phase_seconds)
+
+    def add_profile(self, report):
+        """
+        Сохраняет отчет профилировщика и возвращает его идентификатор
+        """
+        profile_id = uuid.uuid4().hex
+        with self._lock:
+            self._profiles[profile_id] = report
+            while len(self._profiles) > PROFILE_KEEP:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get_profile(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def render(self, gauges=None):
+        """
+        Метрики в текстовом формате Prometheus. gauges - дополнительные
+        значения {имя: (описание, число)} (например, состояние кэша).
+        """
+        lines = []
+        with self._lock:
+            lines += _render_histograms(
+                "propisi_request_duration_seconds", "Время обработки запроса",
+                {(_labels(route=route, method=method)): h for (route, method), h in self.latency.items()},
+            )
+            lines += _render_histograms(
+                "propisi_request_phase_seconds", "Время фаз обработки запроса",
+                {(_labels(route=route, phase=phase)): h for (route, phase), h in self.phases.items()},
+            )
+            lines += ["# HELP propisi_requests_total Количество ответов", "# TYPE propisi_requests_total counter"]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f"propisi_requests_total{_labels(route=route, method=method, status=status)} {count}")
+            lines += ["# HELP propisi_request_errors_total Ответы с ошибкой сервера (5xx)", "# TYPE propisi_request_errors_total counter"]
+            for route, count in sorted(self.errors.items()):
+                lines.append(f"propisi_request_errors_total{_labels(route=route)} {count}")
+            lines += ["# HELP propisi_response_bytes_total Объем отданных данных", "# TYPE propisi_response_bytes_total counter"]
+            for route, count in sorted(self.response_bytes.items()):
+                lines.append(f"propisi_response_bytes_total{_labels(route=route)} {count}")
+        for name, (description, value) in (gauges or {}).items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _render_histograms(name, description, histograms):
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for labels, h in sorted(histograms.items()):
+        # Метки корзины добавляются к меткам гистограммы
+        base = labels[:-1] + "," if labels != "{}" else "{"
+        for bound, count in zip(h.buckets, h.counts):
+            lines.append(f'{name}_bucket{base}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{base}le="+Inf"}} {h.count}')
+        lines.append(f"{name}_sum{labels} {round(h.sum, 6)}")
+        lines.append(f"{name}_count{labels} {h.count}")
+    return lines
+
+
+class RequestMetrics:
+    """
+    Данные текущего запроса: время фаз и запрос на профилирование
+    """
+
+    def __init__(self, profile=False):
+        self.phases = {}
+        self.profile = profile
+        self.profile_id = None
+
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def record_phases(timings):
+    """
+    Добавляет время фаз (словарь {фаза: секунды}) к метрикам текущего запроса
+    """
+    current = _current.get()
+    if current is None or not timings:
+        return
+    for phase, seconds in timings.items():
+        current.phases[phase] = current.phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def record_phase(phase):
+    """
+    Измеряет блок кода как фазу текущего запроса
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phases({phase: time.perf_counter() - start})
+
+
+def profiling_requested():
+    current = _current.get()
+    return bool(current and current.profile)
+
+
+def attach_profile(registry, report):
+    """
+    Сохраняет отчет профилировщика текущего запроса (идентификатор уйдет в заголовке ответа)
+    """
+    current = _current.get()
+    if current is not None and report:
+        current.profile_id = registry.add_profile(report)
+
+
+def call_with_timings(fn, args, profile=False):
+    """
+    Вызывает fn(*args, timings=...) и возвращает (результат, время фаз, отчет cProfile или None).
+    Выполняется в исполнителе, поэтому все результаты возвращаются значением,
+    а не через общие объекты (это работает и в отдельном процессе).
+    """
+    timings = {}
+    if not profile:
+        return fn(*args, timings=timings), timings, None
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args, timings=timings)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return result, timings, out.getvalue()
+
+
+def timed(timings, phase, start):
+    """
+    Добавляет к timings[phase] время с момента start (если timings передан)
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + now - start
+    return now
+
+
+class MetricsMiddleware:
+    """
+    ASGI-промежуточный слой: измеряет задержку, код ответа и объем данных
+    каждого запроса и передает их в MetricsRegistry.
+    """
+
+    def __init__(self, app, registry, profiling_token=None):
+        self.app = app
+        self.registry = registry
+        self.profiling_token = profiling_token if profiling_token is not None else os.environ.get("PROFILING_TOKEN", "")
+        self._routes = {}
+
+    def _route_label(self, scope):
+        # Метка - шаблон маршрута, а не фактический путь, чтобы имена файлов
+        # и идентификаторы задач не порождали новых рядов метрик
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        label = self._routes.get(endpoint)
+        if label is None:
+            label = "unmatched"
+            for route in getattr(scope.get("app"), "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    label = route.path
+                    break
+            self._routes[endpoint] = label
+        return label
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        profile = bool(self.profiling_token) and headers.get(b"x-profile", b"").decode("latin-1") == self.profiling_token
+        current = RequestMetrics(profile=profile)
+        token = _current.set(current)
+        start = time.perf_counter()
+        status = 500
+        body_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if current.profile_id:
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"x-profile-id", current.profile_id.encode("latin-1")),
+                    ])
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self.registry.observe_request(
+                self._route_label(scope), scope.get("method", ""), status,
+                time.perf_counter() - start, body_bytes, current.phases,
+            )
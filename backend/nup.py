@@ -0,0 +1,271 @@
+"""
+Несколько упражнений на одном листе (N-up).
+
+Каждый блок упражнения задается отдельно: свой текст, заполнение, линовка
+и цвет текста; параметры, не указанные в блоке, берутся с уровня листа.
+Раскладка - отдельный проход до рисования: блоки по порядку укладываются
+в колонки сверху вниз (next-fit), не поместившийся блок переходит в
+следующую колонку, затем на следующую страницу. С параметром per_page
+лист делится на равные ячейки (2, 4, 6 или 8 на страницу).
+
+Разметка блока рисуется в шаблон один раз для каждого сочетания линовки
+и размера блока и вставляется как Form XObject, поэтому одинаковые блоки
+на всех страницах ссылаются на одну форму.
+"""
+import io
+import math
+import time
+from dataclasses import asdict, dataclass
+
+from reportlab.pdfgen import canvas
+
+from fonts import font_registry
+from metrics import timed
+from ruling import LINE_HEIGHT, MARGIN_BOTTOM, MARGIN_LEFT, MARGIN_TOP, stamp_block_ruling
+from worksheet import (
+    MAX_PAGES, TEXT_INSET, PageLimitExceeded, WorksheetSpec, base_font, draw_propisi_header, draw_propisi_rows,
+    get_render_profile, layout_propisi_rows, save_pdf, text_fill_color,
+)
+
+# Допустимое количество блоков на странице при раскладке по равным ячейкам
+PER_PAGE_CHOICES = (1, 2, 4, 6, 8)
+# Ограничение на количество блоков в одном документе
+MAX_BLOCKS = 64
+MAX_COLUMNS = 4
+# Строк в блоке, если их число не задано и не следует из текста
+DEFAULT_BLOCK_ROWS = 3
+# Отступы между блоками и колонками
+BLOCK_GAP = 12
+COLUMN_GAP = 18
+# Высота подписи блока
+BLOCK_TITLE_HEIGHT = 16
+
+
+@dataclass(frozen=True)
+class NupBlock:
+    """
+    Блок упражнения: лист прописи, число строк (0 - по тексту) и подпись
+    """
+    sheet: WorksheetSpec
+    rows: int = 0
+    title: str = ""
+
+
+@dataclass(frozen=True)
+class NupSpec:
+    """
+    Лист из нескольких блоков. page задает ориентацию, шрифт, профиль
+    вывода и шапку (имя ученика и дату).
+    """
+    page: WorksheetSpec
+    blocks: tuple
+    columns: int = 1
+    per_page: int = 0
+
+    @classmethod
+    def from_request(cls, data):
+        """
+        Приводит параметры запроса к каноническому виду.
+        ValueError - если блоков больше MAX_BLOCKS (лишние не отбрасываются молча).
+        """
+        page = WorksheetSpec.from_request(data)
+        blocks_data = data.get("blocks") or []
+        if len(blocks_data) > MAX_BLOCKS:
+            raise ValueError(f"Слишком много упражнений: не более {MAX_BLOCKS}")
+        blocks = []
+        for block_data in blocks_data:
+            if not isinstance(block_data, dict):
+                continue
+            # Параметры, не указанные в блоке, берутся с уровня листа
+            sheet = WorksheetSpec.from_request(dict(data, **block_data))
+            blocks.append(NupBlock(
+                sheet=sheet,
+                rows=_int_param(block_data.get("rows"), 0),
+                title=str(block_data.get("title") or ""),
+            ))
+
+        per_page = _int_param(data.get("per_page"), 0)
+        if per_page not in PER_PAGE_CHOICES:
+            per_page = 0
+        columns = _int_param(data.get("columns"), 0)
+        if not 1 <= columns <= MAX_COLUMNS:
+            columns = default_columns(per_page, page.page_orientation)
+        return cls(page=page, blocks=tuple(blocks), columns=columns, per_page=per_page)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _int_param(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def default_columns(per_page, page_orientation):
+    """
+    Колонки по умолчанию: в книжной ориентации блоки идут в одну-две колонки,
+    в альбомной - ячейки вытягиваются по ширине листа
+    """
+    if per_page <= 1:
+        return 1
+    if page_orientation == "landscape":
+        return per_page if per_page <= 2 else per_page // 2
+    return 1 if per_page <= 2 else 2
+
+
+@dataclass(frozen=True)
+class Placement:
+    """
+    Положение блока на странице: левый нижний угол, размер и число строк текста
+    """
+    block: int
+    x: float
+    y: float
+    width: float
+    height: float
+    rows: int
+
+
+def block_title_height(block):
+    return BLOCK_TITLE_HEIGHT if block.title else 0
+
+
+def text_capacity(ruling_height):
+    """
+    Сколько строк текста помещается в разметку заданной высоты
+    """
+    return int(ruling_height // (LINE_HEIGHT * 2))
+
+
+def requested_rows(block, width):
+    if block.rows > 0:
+        return block.rows
+    return max(1, len(layout_propisi_rows(block.sheet, DEFAULT_BLOCK_ROWS, width - 2 * TEXT_INSET)))
+
+
+def check_page_count(page_count):
+    if page_count > MAX_PAGES:
+        raise PageLimitExceeded(
+            f"Упражнения не помещаются в {MAX_PAGES} стр.: уменьшите количество или размер блоков",
+            max_pages=MAX_PAGES,
+        )
+
+
+def layout_blocks(spec):
+    """
+    Раскладка блоков по страницам: список страниц, на каждой - список Placement.
+    Если страниц нужно больше MAX_PAGES, выбрасывается PageLimitExceeded.
+    """
+    width, height = spec.page.pagesize
+    left, top, bottom = MARGIN_LEFT, height - MARGIN_TOP, MARGIN_BOTTOM
+    columns = spec.columns
+    column_width = (width - 2 * MARGIN_LEFT - (columns - 1) * COLUMN_GAP) / columns
+    column_height = top - bottom
+
+    pages = []
+    if spec.per_page:
+        # Равные ячейки: строки ячеек сверху вниз, в строке - слева направо
+        slot_rows = math.ceil(spec.per_page / columns)
+        slot_height = (column_height - (slot_rows - 1) * BLOCK_GAP) / slot_rows
+        for index, block in enumerate(spec.blocks):
+            slot = index % spec.per_page
+            if slot == 0:
+                pages.append([])
+            row, column = divmod(slot, columns)
+            ruling_height = slot_height - block_title_height(block)
+            pages[-1].append(Placement(
+                block=index,
+                x=left + column * (column_width + COLUMN_GAP),
+                y=top - row * (slot_height + BLOCK_GAP) - slot_height,
+                width=column_width,
+                height=ruling_height,
+                rows=text_capacity(ruling_height),
+            ))
+        check_page_count(len(pages))
+        return pages
+
+    # Блоки по высоте их текста: колонка заполняется сверху вниз, пока блок помещается
+    max_rows = text_capacity(column_height - BLOCK_TITLE_HEIGHT)
+    column, cursor = columns, top
+    for index, block in enumerate(spec.blocks):
+        rows = max(1, min(requested_rows(block, column_width), max_rows))
+        ruling_height = rows * LINE_HEIGHT * 2
+        block_height = block_title_height(block) + ruling_height
+        if column >= columns or cursor - block_height < bottom:
+            column += 1
+            cursor = top
+            if column >= columns:
+                check_page_count(len(pages) + 1)
+                pages.append([])
+                column = 0
+        pages[-1].append(Placement(
+            block=index,
+            x=left + column * (column_width + COLUMN_GAP),
+            y=cursor - block_height,
+            width=column_width,
+            height=ruling_height,
+            rows=rows,
+        ))
+        cursor -= block_height + BLOCK_GAP
+    return pages
+
+
+def draw_block(c, block, placement, font_name):
+    """
+    Подпись, разметка и текст одного блока
+    """
+    top = placement.y + placement.height
+    if block.title:
+        c.setFont(base_font(), 10)
+        c.drawString(placement.x, top + 4, block.title)
+
+    stamp_block_ruling(c, block.sheet.page_layout, placement.x, placement.y, placement.width, placement.height)
+
+    rows = layout_propisi_rows(block.sheet, placement.rows, placement.width - 2 * TEXT_INSET)[:placement.rows]
+    if rows:
+        # draw_propisi_rows отсчитывает текст от поля листа, поэтому сдвигаем его к блоку
+        c.saveState()
+        c.translate(placement.x - MARGIN_LEFT, 0)
+        draw_propisi_rows(
+            c, rows, top - LINE_HEIGHT, text_fill_color(block.sheet.font_type), font_name,
+            dotted=block.sheet.font_type == "punktir",
+        )
+        c.restoreState()
+
+
+def render_nup_to(spec, stream, timings=None):
+    """
+    Рисует лист с блоками упражнений в поток stream и возвращает количество страниц
+    """
+    start = time.perf_counter()
+    pagesize = spec.page.pagesize
+    width, height = pagesize
+    profile = get_render_profile(spec.page.output_profile)
+    c = canvas.Canvas(stream, pagesize=pagesize, invariant=1, pageCompression=int(profile.page_compression))
+
+    pages = layout_blocks(spec) or [[]]
+    start = timed(timings, "layout", start)
+    for page, placements in enumerate(pages):
+        if page:
+            c.showPage()
+            start = timed(timings, "save", start)
+        draw_propisi_header(c, spec.page, width, height)
+        for placement in placements:
+            block = spec.blocks[placement.block]
+            draw_block(c, block, placement, font_registry.resolve(block.sheet.font_family))
+        start = timed(timings, "text", start)
+
+    save_pdf(c, profile)
+    timed(timings, "save", start)
+    return len(pages)
+
+
+def render_nup(spec, timings=None):
+    """
+    Рисует лист с блоками упражнений и возвращает содержимое PDF
+    """
+    buffer = io.BytesIO()
+    render_nup_to(spec, buffer, timings)
+    return buffer.getvalue()
@@ -0,0 +1,278 @@
+"""
+Кэш готовых PDF по содержимому запроса.
+
+Ключ кэша - хэш канонического представления нормализованных параметров,
+поэтому одинаковые прописи отдаются без повторного обращения к ReportLab.
+Первый уровень - LRU в памяти, второй (необязательный) - файлы на диске.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def make_cache_key(kind: str, params: dict) -> str:
+    """
+    Канонический ключ кэша: sha256 от JSON с отсортированными ключами
+    """
+    payload = json.dumps(
+        {"kind": kind, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PdfCache:
+    """
+    Двухуровневый кэш PDF: LRU в памяти и необязательный уровень на диске.
+
+    Записи вытесняются по суммарному размеру, количеству и времени жизни (TTL).
+    Кэш можно использовать из нескольких потоков одновременно. Блокировка
+    памяти не держится во время работы с диском: файлы читаются и пишутся
+    вне ее, а объем дискового уровня считается по списку записанных файлов,
+    без обхода папки. Из обработчиков asyncio вызывайте get_async и put_async -
+    они обращаются к диску в отдельном потоке.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entries: int = 512,
+        ttl: float = 3600,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        # key -> (время записи, данные)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Файлы на диске в порядке записи: key -> размер
+        self._disk_index = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # Файлы, оставшиеся с прошлого запуска, учитываем один раз при создании кэша
+            for _, size, path in sorted(self._disk_files()):
+                key = os.path.basename(path)[:-len(".bin")]
+                self._disk_index[key] = size
+                self._disk_bytes += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Возвращает данные по ключу или None, если записи нет или она устарела
+        """
+        now = time.time()
+        data = self._memory_get(key, now)
+        if data is None:
+            data = self._disk_lookup(key, now)
+        return data
+
+    async def get_async(self, key: str) -> Optional[bytes]:
+        """
+        То же, что get, но файл с диска читается в отдельном потоке
+        """
+        now = time.time()
+        data = self._memory_get(key, now)
+        if data is None:
+            if self.disk_dir:
+                data = await asyncio.to_thread(self._disk_lookup, key, now)
+            else:
+                data = self._disk_lookup(key, now)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Сохраняет данные в кэш (и на диск, если включен дисковый уровень)
+        """
+        with self._lock:
+            self._store(key, data, time.time())
+        self._disk_put(key, data)
+
+    async def put_async(self, key: str, data: bytes) -> None:
+        """
+        То же, что put, но файл на диск записывается в отдельном потоке
+        """
+        with self._lock:
+            self._store(key, data, time.time())
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        with self._disk_lock:
+            self._disk_index.clear()
+            self._disk_bytes = 0
+        for _, _, path in self._disk_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Статистика кэша для наблюдения: попадания, промахи и занятый объем
+        """
+        with self._disk_lock:
+            disk_entries = len(self._disk_index)
+            disk_bytes = self._disk_bytes
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "disk_enabled": bool(self.disk_dir),
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+            }
+
+    # Уровень в памяти: методы _store и _drop вызываются под блокировкой
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, data = entry
+            if self.ttl and now - stored_at > self.ttl:
+                self._drop(key)
+                self.expired += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def _store(self, key, data, now):
+        # Слишком большие документы не кэшируем в памяти
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (now, data)
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    # Уровень на диске: файлы читаются и пишутся без блокировки памяти
+
+    def _disk_path(self, key):
+        # Кроме PDF в кэше лежат и растровые предпросмотры
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _disk_files(self):
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return []
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def _disk_lookup(self, key, now):
+        """
+        Ищет запись на диске и переносит найденную в память (вызывается вне блокировки)
+        """
+        data = self._disk_get(key, now)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, data, now)
+            return data
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self.ttl and now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                self._disk_forget(key)
+                with self._lock:
+                    self.expired += 1
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # Файл удален (вытеснен или очищен) - забываем его
+            self._disk_forget(key)
+            return None
+
+    def _disk_forget(self, key):
+        with self._disk_lock:
+            size = self._disk_index.pop(key, None)
+            if size is not None:
+                self._disk_bytes -= size
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Не удалось записать кэш на диск: {e}")
+            return
+
+        # Самые старые файлы сверх лимита выбираем по счетчику, без обхода папки
+        evicted = []
+        with self._disk_lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                oldest, size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(self._disk_path(oldest))
+            except OSError:
+                continue
+            with self._lock:
+                self.evictions += 1
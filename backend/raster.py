@@ -0,0 +1,187 @@
+"""
+Растровый предпросмотр прописи без PDF и без Poppler.
+
+RasterCanvas повторяет ту часть API reportlab Canvas, которой пользуются
+функции рисования разметки и текста, и рисует сразу в изображение Pillow.
+Так предпросмотр строится тем же кодом, что и PDF, но сразу в PNG/WebP.
+Страница рисуется по сцене (scene.py), и готовые начальные слои сцены
+(разметка, разметка с шапкой) берутся из кэша.
+"""
+import io
+import os
+import threading
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from fonts import font_registry
+from metrics import timed
+from raster_formats import RASTER_FORMATS
+from text_layout import TextRuns
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+# Файлы шрифтов для растрового вывода стандартных шрифтов PDF (с кириллицей)
+RASTER_FONT_FILES = {
+    "Helvetica": ("DejaVuSans.ttf", "LiberationSans-Regular.ttf", "Arial.ttf", os.path.join(FONTS_DIR, "propisi.ttf")),
+}
+
+_font_cache = {}
+_font_lock = threading.Lock()
+
+
+def load_raster_font(name, pixel_size):
+    """
+    Шрифт Pillow нужного размера; загружается один раз на имя и размер
+    """
+    key = (name, pixel_size)
+    font = _font_cache.get(key)
+    if font is None:
+        with _font_lock:
+            font = _font_cache.get(key)
+            if font is None:
+                # Шрифты прописей берем из того же файла TTF, что и для PDF
+                font_file = font_registry.font_file(name)
+                candidates = (font_file,) if font_file else RASTER_FONT_FILES.get(name, RASTER_FONT_FILES["Helvetica"])
+                for candidate in candidates:
+                    try:
+                        font = ImageFont.truetype(candidate, pixel_size)
+                        break
+                    except OSError:
+                        continue
+                else:
+                    font = ImageFont.load_default()
+                _font_cache[key] = font
+    return font
+
+
+def _rgb(color):
+    return tuple(int(round(channel * 255)) for channel in (color.red, color.green, color.blue))
+
+
+class RasterCanvas:
+    """
+    Холст Pillow с подмножеством API reportlab Canvas.
+    Координаты в пунктах PDF, начало координат в левом нижнем углу.
+    """
+
+    def __init__(self, pagesize, dpi=96, image=None):
+        self.pagesize = pagesize
+        self.scale = dpi / 72.0
+        width, height = pagesize
+        size = (int(round(width * self.scale)), int(round(height * self.scale)))
+        self.image = image.copy() if image is not None else Image.new("RGB", size, "white")
+        self._draw = ImageDraw.Draw(self.image)
+        self._stroke = (0, 0, 0)
+        self._fill = (0, 0, 0)
+        self._line_width = 1
+        self._font_name = "Helvetica"
+        self._font_size = 12
+
+    def _point(self, x, y):
+        return (x * self.scale, (self.pagesize[1] - y) * self.scale)
+
+    def setLineWidth(self, width):
+        self._line_width = width
+
+    def setStrokeColor(self, color):
+        self._stroke = _rgb(color)
+
+    def setFillColor(self, color):
+        self._fill = _rgb(color)
+
+    def setDash(self, array=None, phase=0):
+        # Пунктир в растровом предпросмотре не передается
+        pass
+
+    def setFont(self, name, size, leading=None):
+        self._font_name = name
+        self._font_size = size
+
+    def line(self, x1, y1, x2, y2):
+        pixel_width = self._line_width * self.scale
+        color = self._stroke
+        if pixel_width < 1:
+            # Линия тоньше пикселя: осветляем цвет пропорционально покрытию, как при сглаживании
+            color = tuple(int(round(255 - (255 - channel) * pixel_width)) for channel in color)
+        width = max(1, int(round(pixel_width)))
+        self._draw.line([self._point(x1, y1), self._point(x2, y2)], fill=color, width=width)
+
+    def lines(self, linelist):
+        for x1, y1, x2, y2 in linelist:
+            self.line(x1, y1, x2, y2)
+
+    def _text(self, x, y, text, anchor):
+        font = load_raster_font(self._font_name, max(1, int(round(self._font_size * self.scale))))
+        self._draw.text(self._point(x, y), text, font=font, fill=self._fill, anchor=anchor)
+
+    def drawString(self, x, y, text):
+        self._text(x, y, text, "ls")
+
+    def beginText(self, x=0, y=0):
+        return TextRuns(self._font_name, self._font_size, x, y)
+
+    def drawText(self, text_object):
+        for font_name, font_size, x, y, text in text_object.runs:
+            self.setFont(font_name, font_size)
+            self._text(x, y, text, "ls")
+
+    def drawRightString(self, x, y, text):
+        self._text(x, y, text, "rs")
+
+    def to_bytes(self, image_format="png"):
+        pil_format, _ = RASTER_FORMATS[image_format]
+        buffer = io.BytesIO()
+        if pil_format == "PNG":
+            self.image.save(buffer, pil_format, compress_level=6)
+        else:
+            self.image.save(buffer, pil_format, quality=80, method=4)
+        return buffer.getvalue()
+
+
+# Промежуточные изображения сцены: (хэш групп от первой до очередной, dpi) -> изображение
+_layer_images = {}
+# Сколько изображений держать в памяти (каждое - до нескольких МБ)
+LAYER_IMAGE_CACHE_SIZE = 24
+_layer_lock = threading.Lock()
+
+
+def _remember_layer(key, image):
+    with _layer_lock:
+        if key in _layer_images:
+            return
+        # Вытесняем самое старое изображение, если кэш заполнен
+        if len(_layer_images) >= LAYER_IMAGE_CACHE_SIZE:
+            _layer_images.pop(next(iter(_layer_images)))
+        _layer_images[key] = image.copy()
+
+
+def render_scene_image(scene, dpi=96, timings=None, layers=None):
+    """
+    Рисует сцену на растровом холсте и возвращает холст. Изображение после
+    каждой группы, кроме последней, запоминается по хэшу групп до нее, поэтому
+    при смене текста разметка и шапка не перерисовываются, а при смене шапки
+    берется готовая разметка. layers - свой словарь слоев вместо общего кэша
+    (например, у сессии живого предпросмотра).
+    """
+    cache = _layer_images if layers is None else layers
+    groups = scene.groups
+    prefixes = scene.prefix_digests()
+    done, image = 0, None
+    for count in range(len(groups) - 1, 0, -1):
+        image = cache.get((prefixes[count - 1], dpi))
+        if image is not None:
+            done = count
+            break
+
+    c = RasterCanvas(scene.pagesize, dpi, image=image)
+    start = time.perf_counter()
+    for index in range(done, len(groups)):
+        groups[index].draw(c)
+        start = timed(timings, groups[index].phase, start)
+        if index < len(groups) - 1:
+            if layers is None:
+                _remember_layer((prefixes[index], dpi), c.image)
+            else:
+                layers.setdefault((prefixes[index], dpi), c.image.copy())
+    return c
@@ -0,0 +1,10 @@
+"""
+Форматы и разрешение растрового предпросмотра.
+
+Отдельно от raster.py, чтобы проверять параметры запроса, не загружая
+Pillow: сам raster импортируется только при рисовании изображения.
+"""
+
+RASTER_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+MIN_DPI = 36
+MAX_DPI = 200
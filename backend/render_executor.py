@@ -0,0 +1,112 @@
+"""
+Исполнитель для тяжелой синхронной работы (рисование PDF, запись файлов).
+
+Обработчики FastAPI отправляют такую работу сюда, чтобы не блокировать
+цикл событий asyncio. Количество одновременно ожидающих задач ограничено:
+при переполнении очереди run() сразу выбрасывает RenderQueueFull.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+EXECUTOR_KINDS = ("inline", "thread", "process")
+
+
+class RenderQueueFull(Exception):
+    """
+    Все исполнители заняты и очередь заполнена
+    """
+
+
+class RenderExecutor:
+    """
+    Пул для рисования PDF: потоки, процессы или выполнение на месте (inline).
+
+    Режим inline выполняет работу прямо в цикле событий, как раньше,
+    и нужен для сравнения в нагрузочном тесте.
+    """
+
+    def __init__(self, kind="thread", max_workers=4, max_pending=32):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Неизвестный тип исполнителя: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self._pool = None
+        # Счетчики меняются только из цикла событий, блокировка не нужна
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                # multiprocessing импортируется только если он действительно нужен
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+        return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) в пуле и возвращает результат
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise RenderQueueFull(f"Очередь рисования заполнена ({self.pending} задач)")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            if self.kind == "inline":
+                return fn(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_pool(), functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - start
+
+    async def map_in_pool(self, pool, fn, args_list):
+        """
+        Выполняет fn(*args) для каждого набора аргументов в другом пуле (например,
+        в пуле пакетной генерации) и возвращает результаты по порядку. Задачи
+        учитываются в той же очереди: если места нет для всех, сразу выбрасывается
+        RenderQueueFull и ни одна задача не запускается.
+        """
+        count = len(args_list)
+        if self.pending + count > self.max_pending:
+            self.rejected += 1
+            raise RenderQueueFull(f"Очередь рисования заполнена ({self.pending} задач)")
+        # Место занимаем сразу для всех задач, до первого await
+        self.pending += count
+        loop = asyncio.get_running_loop()
+
+        async def run_one(args):
+            start = time.perf_counter()
+            try:
+                return await loop.run_in_executor(pool, functools.partial(fn, *args))
+            finally:
+                self.pending -= 1
+                self.completed += 1
+                self.busy_seconds += time.perf_counter() - start
+
+        return await asyncio.gather(*(run_one(args) for args in args_list))
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
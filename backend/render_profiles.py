@@ -0,0 +1,107 @@
+"""
+Профили вывода PDF: как упаковывать документ.
+
+- screen (по умолчанию) - самый маленький файл для загрузки по сети:
+  потоки сжаты, разметка многостраничного листа выносится в общий
+  Form XObject, а в одностраничном рисуется прямо на странице
+  (отдельный объект формы там только добавляет байты).
+- print - разметка всегда отдельной формой, как до появления профилей
+  (принтер обрабатывает форму один раз для всех страниц).
+- uncompressed - несжатые потоки, чтобы читать и сравнивать операторы.
+
+Шрифты TTF ReportLab всегда встраивает подмножеством (только
+использованные глифы), а потоков объектов (object streams) не умеет,
+поэтому эти параметры профилями не управляются.
+"""
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from reportlab import rl_config
+
+# Настройки rl_config общие для процесса: меняем их только на время сохранения документа
+_rl_config_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    name: str
+    # Сжатие потоков страниц и форм (FlateDecode)
+    page_compression: bool
+    # Общие формы только для того, что повторяется на нескольких страницах
+    share_repeated_only: bool
+    # ASCII85 делает сжатые потоки на четверть больше и нужен только для
+    # передачи PDF по 7-битным каналам
+    ascii85: bool = False
+
+
+RENDER_PROFILES = {
+    "screen": RenderProfile("screen", page_compression=True, share_repeated_only=True),
+    "print": RenderProfile("print", page_compression=True, share_repeated_only=False),
+    "uncompressed": RenderProfile("uncompressed", page_compression=False, share_repeated_only=False),
+}
+DEFAULT_RENDER_PROFILE = "screen"
+
+
+def get_render_profile(name):
+    return RENDER_PROFILES.get(name) or RENDER_PROFILES[DEFAULT_RENDER_PROFILE]
+
+
+@contextmanager
+def pdf_output_options(profile):
+    """
+    Настройки ReportLab профиля на время сохранения документа. ReportLab читает
+    rl_config.useA85 при сохранении, а настройка общая для процесса, поэтому
+    она меняется под блокировкой и затем восстанавливается: другие документы
+    процесса ее не видят.
+    """
+    with _rl_config_lock:
+        previous = rl_config.useA85
+        rl_config.useA85 = int(profile.ascii85)
+        try:
+            yield
+        finally:
+            rl_config.useA85 = previous
+
+
+def save_pdf(c, profile):
+    """
+    Сохраняет холст PDF с настройками профиля вывода
+    """
+    with pdf_output_options(profile):
+        c.save()
+
+
+_STREAM_RE = re.compile(rb">>\s*stream\r?\n")
+
+
+def pdf_size_report(pdf):
+    """
+    Из чего складывается размер PDF: байты потоков шрифтов, страниц, форм
+    и изображений; остальное - словари объектов и таблица xref
+    """
+    report = {"total": len(pdf), "fonts": 0, "pages": 0, "forms": 0, "images": 0, "raw_streams": 0}
+    for match in _STREAM_RE.finditer(pdf):
+        # Словарь потока - от начала объекта до ключевого слова stream
+        header = pdf[pdf.rfind(b" obj", 0, match.start()):match.start()]
+        length = int(re.search(rb"/Length (\d+)", header).group(1))
+        if b"/Length1" in header or b"/FontFile" in header:
+            kind = "fonts"
+        elif b"/Subtype /Form" in header:
+            kind = "forms"
+        elif b"/Subtype /Image" in header:
+            kind = "images"
+        elif b"/CMapName" in header:
+            kind = "fonts"
+        else:
+            kind = "pages"
+        report[kind] += length
+        if b"/FlateDecode" in header:
+            data = pdf[match.end():match.end() + length]
+            report["raw_streams"] += len(zlib.decompress(data))
+        else:
+            report["raw_streams"] += length
+    report["other"] = report["total"] - report["fonts"] - report["pages"] - report["forms"] - report["images"]
+    return report
@@ -0,0 +1,333 @@
+"""
+Разметка страницы прописи: школьная клетка и линейка (в том числе с наклоном).
+
+Разметка зависит только от вида линовки, размера страницы и режима
+(предпросмотр или полный лист), поэтому она рисуется один раз в шаблон,
+а в документ вставляется как Form XObject по ссылке. Геометрия линий
+считается массивами NumPy; NumPy импортируется при первом рисовании шаблона,
+чтобы не замедлять холодный старт.
+
+Функции рисования принимают необязательную область видимости viewport
+(xmin, ymin, xmax, ymax) и строят только ту геометрию, что в нее попадает:
+предпросмотр и части листа стоят пропорционально показанной площади,
+а внутри области вывод тот же, что и без нее.
+"""
+import io
+import math
+import threading
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import Color
+from reportlab.lib.pagesizes import A4, landscape
+
+# Геометрия листа, общая для предпросмотра и полного PDF
+MARGIN_LEFT = 30
+MARGIN_TOP = 80
+MARGIN_BOTTOM = 30
+LINE_HEIGHT = 12  # высота строки
+CELL_SIZE = 15  # размер клетки в пунктах
+PREVIEW_HEIGHT = 300  # высота разметки в предпросмотре
+SLANT_ANGLE = 58  # угол наклона косых линий, градусов
+SLANT_STEP = 10  # шаг между косыми линиями, пунктов
+
+# Цвета линий разметки
+GRID_GRAY = Color(0.7, 0.7, 0.7)  # Светло-серый цвет для сетки
+BASELINE_GRAY = Color(0.6, 0.6, 0.6)  # Основная (средняя) линия прописи
+HELPER_GRAY = Color(0.85, 0.85, 0.85)  # Верхняя и нижняя линии
+SLANT_GRAY = Color(0.8, 0.8, 0.8)  # Наклонные линии
+# Точность координат в коде PDF: сотая доля пункта незаметна на печати,
+# а округление делает вывод одинаковым при любых погрешностях вычислений
+COORD_DECIMALS = 2
+
+def stroke_segments(c, segments):
+    """
+    Рисует все отрезки (массив N x 4: x0, y0, x1, y1) одним путем с одной обводкой
+    """
+    import numpy as np
+
+    if len(segments):
+        c.lines(np.round(segments, COORD_DECIMALS).tolist())
+
+def span_in_viewport(start, end, low, high, viewport=None):
+    """
+    Пересечение отрезка [start, end] с диапазоном [low, high] области видимости
+    (без области - сам отрезок); None, если пересечения нет
+    """
+    if viewport is None:
+        return start, end
+    start, end = max(start, low), min(end, high)
+    return (start, end) if start <= end else None
+
+def horizontal_segments(ys, x, width):
+    """
+    Горизонтальные отрезки ширины width для каждого y из массива ys
+    """
+    import numpy as np
+
+    return np.column_stack([np.full_like(ys, x), ys, np.full_like(ys, x + width), ys])
+
+def grid_geometry(x, y, cell_size, rows, cols, viewport=None):
+    """
+    Отрезки школьной клетки: горизонтальные линии сверху вниз, затем вертикальные слева направо.
+    С областью viewport - только линии внутри нее, обрезанные по ее краям.
+    """
+    import numpy as np
+
+    ys = y - np.arange(rows + 1, dtype=float) * cell_size
+    xs = x + np.arange(cols + 1, dtype=float) * cell_size
+    x_span, y_span = (x, x + cols * cell_size), (y - rows * cell_size, y)
+    if viewport is not None:
+        xmin, ymin, xmax, ymax = viewport
+        ys = ys[(ys >= ymin) & (ys <= ymax)]
+        xs = xs[(xs >= xmin) & (xs <= xmax)]
+        x_span = span_in_viewport(*x_span, xmin, xmax, viewport)
+        y_span = span_in_viewport(*y_span, ymin, ymax, viewport)
+        if x_span is None or y_span is None:
+            return np.empty((0, 4))
+    vertical = np.column_stack([xs, np.full_like(xs, y_span[1]), xs, np.full_like(xs, y_span[0])])
+    return np.vstack([horizontal_segments(ys, x_span[0], x_span[1] - x_span[0]), vertical])
+
+# Функция для рисования школьной клетки с наклонными линиями
+def draw_school_grid(c, x, y, cell_size, rows, cols, viewport=None):
+    # Устанавливаем тонкие линии для сетки
+    c.setLineWidth(0.3)
+    c.setStrokeColor(GRID_GRAY)
+    c.setDash([])  # Сплошная линия для клеток
+    
+    # Вся сетка - один путь
+    stroke_segments(c, grid_geometry(x, y, cell_size, rows, cols, viewport))
+    
+    # Не рисуем диагональные линии для соответствия образцу
+    # Диагональные линии только создают визуальный шум
+
+def propisi_line_geometry(y, line_height, count=None):
+    """
+    Положения линий прописи сверху вниз: основные (средние) линии и
+    вспомогательные (верхние и нижние). Нижняя линия строки совпадает
+    с верхней линией следующей, поэтому вспомогательные линии не повторяются.
+    count ограничивает число строк; без него линейка идет до низа страницы.
+    """
+    import numpy as np
+
+    group_height = line_height * 2  # Общая высота группы из трех линий
+    
+    # Заполняем линейкой весь лист, пока нижняя линия строки не выходит за страницу
+    total_groups = int(y / group_height) + 2
+    baselines = y - np.arange(total_groups, dtype=float) * group_height
+    baselines = baselines[baselines - line_height >= 0]
+    if count is not None:
+        baselines = baselines[:max(0, count)]
+    helpers = np.unique(np.round(np.concatenate([baselines + line_height, baselines - line_height]), COORD_DECIMALS))[::-1]
+    return baselines, helpers
+
+# Функция для рисования линейки для прописей
+def draw_propisi_lines(c, x, y, width, line_height, count=None, oblique=False, cover=False, viewport=None):
+    # Настройка для рисования линий
+    c.setLineWidth(0.3)
+    
+    baselines, helpers = propisi_line_geometry(y, line_height, count)
+    if not len(baselines):
+        return
+    # Прямоугольник линейки; косые линии обрезаются по нему
+    clip_rect = (x, baselines[-1] - line_height, x + width, baselines[0] + line_height)
+    x_span = (x, x + width)
+    if viewport is not None:
+        xmin, ymin, xmax, ymax = viewport
+        baselines = baselines[(baselines >= ymin) & (baselines <= ymax)]
+        helpers = helpers[(helpers >= ymin) & (helpers <= ymax)]
+        x_span = span_in_viewport(x, x + width, xmin, xmax, viewport)
+        clip_rect = (max(clip_rect[0], xmin), max(clip_rect[1], ymin), min(clip_rect[2], xmax), min(clip_rect[3], ymax))
+        if x_span is None or clip_rect[1] > clip_rect[3]:
+            return
+    
+    # Каждый цвет - один путь: сначала основные линии, затем вспомогательные
+    c.setStrokeColor(BASELINE_GRAY)
+    stroke_segments(c, horizontal_segments(baselines, x_span[0], x_span[1] - x_span[0]))
+    c.setStrokeColor(HELPER_GRAY)
+    stroke_segments(c, horizontal_segments(helpers, x_span[0], x_span[1] - x_span[0]))
+    
+    # Если выбрана косая линия
+    if oblique:
+        # Настройка для косых линий
+        c.setStrokeColor(SLANT_GRAY)
+        c.setLineWidth(0.25)
+        
+        # Рисуем только видимые части наклонных линий внутри линейки
+        stroke_segments(c, oblique_segments(y, width, clip_rect, cover=cover))
+
+def clip_segments(segments, rect):
+    """
+    Обрезает отрезки (массив N x 4) по прямоугольнику (xmin, ymin, xmax, ymax)
+    методом Лианга-Барски. Возвращает только видимые части отрезков.
+    """
+    import numpy as np
+
+    xmin, ymin, xmax, ymax = rect
+    x0, y0, x1, y1 = segments.T
+    dx = x1 - x0
+    dy = y1 - y0
+    t0 = np.zeros(len(segments))
+    t1 = np.ones(len(segments))
+    visible = np.ones(len(segments), dtype=bool)
+    for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+        parallel = p == 0
+        # Отрезок параллелен границе и лежит снаружи
+        visible &= ~(parallel & (q < 0))
+        t = q / np.where(parallel, 1, p)
+        t0 = np.where(p < 0, np.maximum(t0, t), t0)
+        t1 = np.where(p > 0, np.minimum(t1, t), t1)
+    visible &= t0 < t1
+    clipped = np.column_stack([x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy])
+    return clipped[visible]
+
+def oblique_segments(y, width, rect, step=SLANT_STEP, cover=False):
+    """
+    Видимые отрезки наклонных линий прописи внутри прямоугольника rect.
+    Линии те же, что раньше рисовались через весь лист: с шагом step,
+    под углом SLANT_ANGLE градусов вправо-вниз. На листе они, как и раньше,
+    не доходят до нижнего левого угла; с cover=True линии продолжаются
+    влево, пока не покроют весь rect (так рисуются блоки N-up).
+    """
+    import numpy as np
+
+    # Линии строятся от точки выше верха страницы до точки ниже ее низа
+    extra_distance = 500
+    start_y = y + extra_distance
+    end_y = -extra_distance
+    slope = math.tan(math.radians(SLANT_ANGLE))
+    delta_x = (start_y - end_y) * slope
+    
+    # Ряд линий: first + k * step для k от 0 до last. Строятся только линии,
+    # которые проходят через rect (с запасом в шаг с каждой стороны - лишнее отрежет обрезка)
+    first = -1000
+    last = math.ceil((int(width) + 1000 - first) / step) - 1
+    xmin, ymin, xmax, ymax = rect
+    k_min = math.floor((xmin - (start_y - ymin) * slope - first) / step) - 1
+    k_max = math.ceil((xmax - (start_y - ymax) * slope - first) / step) + 1
+    if not cover:
+        # Начало ряда сдвигается влево только с cover
+        k_min = max(k_min, 0)
+    offsets = first + np.arange(k_min, min(k_max, last) + 1, dtype=float) * step
+    segments = np.column_stack([
+        offsets, np.full_like(offsets, start_y), offsets + delta_x, np.full_like(offsets, end_y),
+    ])
+    return clip_segments(segments, rect)
+
+def draw_page_ruling(c, page_layout, width, height, preview=False):
+    """
+    Рисует разметку всего листа в зависимости от выбранного типа
+    """
+    content_width = width - 2 * MARGIN_LEFT
+    content_height = height - MARGIN_TOP - MARGIN_BOTTOM
+    # Для предпросмотра рисуем только первую часть страницы
+    viewport = preview_viewport(width, height) if preview else None
+    
+    if page_layout == "cells":
+        rows = int(content_height / CELL_SIZE)
+        cols = int(content_width / CELL_SIZE)
+        draw_school_grid(c, MARGIN_LEFT, height - MARGIN_TOP, CELL_SIZE, rows, cols, viewport)
+    else:
+        oblique = page_layout == "lines_oblique"
+        draw_propisi_lines(c, MARGIN_LEFT, height - MARGIN_TOP, content_width, LINE_HEIGHT, oblique=oblique, viewport=viewport)
+
+def preview_viewport(width, height):
+    """
+    Область листа, которую показывает предпросмотр: от верха страницы
+    до PREVIEW_HEIGHT ниже начала разметки
+    """
+    content_height = height - MARGIN_TOP - MARGIN_BOTTOM
+    return (0, height - MARGIN_TOP - min(PREVIEW_HEIGHT, content_height), width, height)
+
+# Готовые операторы разметки: (page_layout, width, height, preview) -> код PDF
+_ruling_templates = {}
+_templates_lock = threading.Lock()
+
+def _cached_template(key, pagesize, draw):
+    ops = _ruling_templates.get(key)
+    if ops is None:
+        with _templates_lock:
+            ops = _ruling_templates.get(key)
+            if ops is None:
+                # Рисуем разметку на черновом холсте и забираем накопленный код страницы
+                scratch = canvas.Canvas(io.BytesIO(), pagesize=pagesize)
+                draw(scratch)
+                ops = "\n".join(scratch._code)
+                _ruling_templates[key] = ops
+    return ops
+
+def get_ruling_template(page_layout, pagesize, preview=False):
+    """
+    Возвращает операторы PDF для разметки листа, рисуя их при первом обращении
+    """
+    width, height = pagesize
+    key = (page_layout, float(width), float(height), bool(preview))
+    return _cached_template(key, pagesize, lambda c: draw_page_ruling(c, page_layout, width, height, preview))
+
+def draw_block_ruling(c, page_layout, width, height):
+    """
+    Разметка прямоугольного блока упражнения с левым нижним углом в начале координат.
+    Все линии лежат внутри блока (и BBox его формы): первая основная линия - на
+    LINE_HEIGHT ниже верха, как и первая строка текста блока.
+    """
+    if page_layout == "cells":
+        draw_school_grid(c, 0, height, CELL_SIZE, int(height / CELL_SIZE), int(width / CELL_SIZE))
+    else:
+        rows = int(height // (LINE_HEIGHT * 2))
+        draw_propisi_lines(c, 0, height - LINE_HEIGHT, width, LINE_HEIGHT, rows, page_layout == "lines_oblique", cover=True)
+
+def get_block_ruling_template(page_layout, width, height):
+    """
+    Операторы PDF для разметки блока заданного размера (кэшируются как и шаблоны листа)
+    """
+    key = ("block", page_layout, float(width), float(height))
+    return _cached_template(key, (width, height), lambda c: draw_block_ruling(c, page_layout, width, height))
+
+def stamp_block_ruling(c, page_layout, x, y, width, height):
+    """
+    Вставляет разметку блока с левым нижним углом в точке (x, y).
+    Блоки одного размера и вида ссылаются на одну форму документа.
+    """
+    name = f"block_{page_layout}_{round(width * 100)}x{round(height * 100)}"
+    if not c.hasForm(name):
+        c.beginForm(name, 0, 0, width, height)
+        c.addLiteral(get_block_ruling_template(page_layout, width, height))
+        c.endForm()
+    c.saveState()
+    c.translate(x, y)
+    c.doForm(name)
+    c.restoreState()
+
+def ruling_form_name(page_layout, pagesize, preview=False):
+    width, height = pagesize
+    mode = "preview" if preview else "full"
+    return f"ruling_{page_layout}_{mode}_{int(width)}x{int(height)}"
+
+def stamp_ruling(c, page_layout, pagesize, preview=False, shared=True):
+    """
+    Вставляет разметку на текущую страницу.
+    Form XObject создается один раз на документ, страницы ссылаются на него.
+    Если shared=False (разметка нужна только на одной странице), операторы
+    пишутся прямо в страницу - без лишнего объекта формы.
+    """
+    if not shared:
+        c.addLiteral("q")
+        c.addLiteral(get_ruling_template(page_layout, pagesize, preview))
+        c.addLiteral("Q")
+        return
+    name = ruling_form_name(page_layout, pagesize, preview)
+    if not c.hasForm(name):
+        width, height = pagesize
+        c.beginForm(name, 0, 0, width, height)
+        c.addLiteral(get_ruling_template(page_layout, pagesize, preview))
+        c.endForm()
+    c.doForm(name)
+
+def warm_ruling_templates():
+    """
+    Заранее рисует шаблоны для всех видов разметки и ориентаций листа
+    """
+    for pagesize in (A4, landscape(A4)):
+        for page_layout in ("cells", "lines", "lines_oblique"):
+            for preview in (False, True):
+                get_ruling_template(page_layout, pagesize, preview)
+    return len(_ruling_templates)
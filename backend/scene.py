@@ -0,0 +1,121 @@
+"""
+Сцена листа: промежуточное представление между параметрами и выводом.
+
+Страница - это Scene из групп SceneGroup (разметка, шапка, текст). Группа
+знает, как себя нарисовать на холсте с API reportlab Canvas (PDF, растровый
+RasterCanvas или SvgCanvas), и задается ключом - параметрами, от которых
+зависит ее содержимое. По ключу считается хэш группы, по хэшам групп - хэш
+сцены, поэтому сцену можно построить, не рисуя ее, сравнить с предыдущей
+(Scene.diff) и перерисовать только изменившиеся группы: готовые группы
+берутся из кэшей вывода по хэшу (операторы PDF разметки, фрагменты SVG,
+промежуточные изображения растра).
+"""
+import hashlib
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Callable, Optional
+
+from metrics import timed
+
+
+@dataclass(frozen=True)
+class SceneGroup:
+    """
+    Группа сцены. key - параметры, полностью задающие содержимое группы
+    (кортеж из строк, чисел, None и вложенных кортежей). Если у группы есть
+    ops, она не зависит от документа (нет текста) и в PDF вставляется
+    готовыми операторами, общими для всех документов.
+    """
+    name: str
+    key: tuple
+    draw: Callable = field(compare=False, repr=False)
+    # Фаза, в которую записывается время рисования группы (см. metrics)
+    phase: str = "text"
+    ops: Optional[Callable] = field(default=None, compare=False, repr=False)
+
+    @cached_property
+    def digest(self):
+        return hashlib.sha1(repr((self.name, self.key)).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class Scene:
+    """
+    Страница листа: размер и группы в порядке рисования
+    """
+    pagesize: tuple
+    groups: tuple
+
+    @cached_property
+    def digest(self):
+        parts = [repr(tuple(self.pagesize))] + [group.digest for group in self.groups]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def prefix_digests(self):
+        """
+        Хэши начальных частей сцены: размер страницы и группы от первой до i-й
+        """
+        digests, parts = [], [repr(tuple(self.pagesize))]
+        for group in self.groups:
+            parts.append(group.digest)
+            digests.append(hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16])
+        return digests
+
+    def group(self, name):
+        return next((group for group in self.groups if group.name == name), None)
+
+    def diff(self, other):
+        """
+        Имена групп этой сцены, которые отличаются от групп сцены other
+        (или которых в ней нет). Для other=None или другого размера страницы - все группы.
+        """
+        if other is None or tuple(other.pagesize) != tuple(self.pagesize):
+            return tuple(group.name for group in self.groups)
+        previous = {group.name: group.digest for group in other.groups}
+        return tuple(group.name for group in self.groups if previous.get(group.name) != group.digest)
+
+
+def group_form_name(group):
+    return f"{group.name}_{group.digest}"
+
+
+def draw_group_pdf(c, group, pagesize, shared=False):
+    """
+    Рисует группу на холсте PDF. Группа с готовыми операторами при shared=True
+    вставляется общей для документа формой, иначе - операторами прямо в страницу.
+    """
+    if group.ops is None:
+        group.draw(c)
+        return
+    if not shared:
+        c.addLiteral("q")
+        c.addLiteral(group.ops())
+        c.addLiteral("Q")
+        return
+    name = group_form_name(group)
+    if not c.hasForm(name):
+        width, height = pagesize
+        c.beginForm(name, 0, 0, width, height)
+        c.addLiteral(group.ops())
+        c.endForm()
+    c.doForm(name)
+
+
+def draw_scenes_pdf(c, scenes, share_all=False, timings=None):
+    """
+    Рисует страницы-сцены на холсте PDF (новая страница на каждую сцену).
+    Группы с готовыми операторами, которые повторяются на нескольких страницах
+    (или все такие группы при share_all), выносятся в общие формы.
+    """
+    uses = Counter(group.digest for scene in scenes for group in scene.groups)
+    start = time.perf_counter()
+    for page, scene in enumerate(scenes):
+        if page:
+            c.showPage()
+            start = timed(timings, "save", start)
+        for group in scene.groups:
+            draw_group_pdf(c, group, scene.pagesize, shared=share_all or uses[group.digest] > 1)
+            start = timed(timings, group.phase, start)
+    return len(scenes)
@@ -0,0 +1,132 @@
+"""
+Хранилище временных файлов (предпросмотры, готовые PDF, архивы) в temp_dir.
+
+Файлы получают уникальные имена и удаляются фоновой очисткой:
+сначала по времени жизни, затем самые старые - пока общий объем
+не уложится в лимит.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+# Файлы, которыми управляет хранилище; остальное содержимое temp_dir не трогаем
+MANAGED_PREFIXES = ("preview_", "propisi_", "render_")
+
+
+class TempStorage:
+    """
+    Временные файлы сервера с ограничением по объему и времени жизни
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.swept_files = 0
+        self.swept_bytes = 0
+        self.last_sweep = None
+
+    def new_filename(self, prefix, extension="pdf"):
+        """
+        Уникальное имя файла: не совпадает даже при одновременных запросах
+        """
+        return f"{prefix}_{uuid.uuid4().hex}.{extension}"
+
+    def path(self, filename):
+        """
+        Путь к файлу хранилища; имена с путями отклоняются
+        """
+        if not filename or os.path.basename(filename) != filename or filename.startswith("."):
+            raise ValueError(f"Недопустимое имя файла: {filename}")
+        return os.path.join(self.directory, filename)
+
+    def _managed_files(self):
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return files
+        for entry in entries:
+            if not entry.name.startswith(MANAGED_PREFIXES):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def sweep(self):
+        """
+        Удаляет устаревшие файлы, затем самые старые сверх лимита объема.
+        Возвращает количество удаленных файлов.
+        """
+        with self._lock:
+            now = time.time()
+            files = sorted(self._managed_files())
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for mtime, size, path in files:
+                expired = self.ttl and now - mtime > self.ttl
+                if not expired and total <= self.max_bytes:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+                self.swept_files += 1
+                self.swept_bytes += size
+            self.last_sweep = now
+            return removed
+
+    def clear(self):
+        """
+        Удаляет все файлы хранилища (при остановке сервера).
+        Возвращает количество удаленных файлов.
+        """
+        with self._lock:
+            removed = 0
+            for _, _, path in self._managed_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+            return removed
+
+    def usage(self):
+        """
+        Занятое место на диске и статистика очистки.
+        Обходит temp_dir, поэтому из цикла событий вызывается через asyncio.to_thread.
+        """
+        files = self._managed_files()
+        return {
+            "directory": self.directory,
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "swept_files": self.swept_files,
+            "swept_bytes": self.swept_bytes,
+            "last_sweep": self.last_sweep,
+        }
+
+    async def run_sweeper(self, interval=60):
+        """
+        Фоновая очистка: запускается при старте сервера и работает до его остановки
+        """
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep)
+                if removed:
+                    print(f"Удалено временных файлов: {removed}")
+            except Exception as e:
+                print(f"Ошибка при очистке временных файлов: {str(e)}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,173 @@
+"""
+Вывод листа прописи в SVG.
+
+SvgCanvas повторяет ту же часть API reportlab Canvas, что и RasterCanvas,
+и записывает элементы SVG, поэтому лист рисуется тем же кодом, что и PDF.
+Каждая группа сцены (scene.py) превращается во фрагмент SVG один раз:
+фрагменты кэшируются по хэшу группы, и при смене одного параметра
+пересобирается только его группа. Шрифты из файлов TTF встраиваются в
+документ через @font-face, стандартные шрифты PDF заменяются системными.
+Пунктирный текст, как и в растровом предпросмотре, выводится заливкой.
+"""
+import base64
+import threading
+import time
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from reportlab.lib.rl_accel import fp_str
+
+from fonts import font_registry
+from metrics import timed
+from text_layout import TextRuns
+
+SVG_MEDIA_TYPE = "image/svg+xml"
+# Сколько фрагментов групп держать в памяти
+FRAGMENT_CACHE_SIZE = 256
+# Системные шрифты вместо стандартных шрифтов PDF
+STANDARD_FONT_FAMILIES = {
+    "Helvetica": "Helvetica, Arial, sans-serif",
+    "Times-Roman": "'Times New Roman', serif",
+    "Courier": "Courier, monospace",
+}
+
+
+def _hex(color):
+    return "#%02x%02x%02x" % tuple(int(round(channel * 255)) for channel in (color.red, color.green, color.blue))
+
+
+def font_family(font_name):
+    if font_registry.font_file(font_name):
+        return font_name
+    return STANDARD_FONT_FAMILIES.get(font_name, STANDARD_FONT_FAMILIES["Helvetica"])
+
+
+@lru_cache(maxsize=16)
+def font_face(font_name):
+    """
+    Правило @font-face со встроенным файлом TTF шрифта
+    """
+    with open(font_registry.font_file(font_name), "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    return f'@font-face{{font-family:"{font_name}";src:url(data:font/ttf;base64,{data}) format("truetype")}}'
+
+
+class SvgCanvas:
+    """
+    Холст SVG с подмножеством API reportlab Canvas.
+    Координаты в пунктах PDF, начало координат в левом нижнем углу.
+    """
+
+    def __init__(self, pagesize):
+        self.pagesize = pagesize
+        self.elements = []
+        # Шрифты, которыми выведен текст (их нужно встроить в документ)
+        self.fonts = set()
+        self._stroke = "#000000"
+        self._fill = "#000000"
+        self._line_width = 1
+        self._dash = ""
+        self._font_name = "Helvetica"
+        self._font_size = 12
+
+    def _y(self, y):
+        return self.pagesize[1] - y
+
+    def setLineWidth(self, width):
+        self._line_width = width
+
+    def setStrokeColor(self, color):
+        self._stroke = _hex(color)
+
+    def setFillColor(self, color):
+        self._fill = _hex(color)
+
+    def setDash(self, array=None, phase=0):
+        self._dash = f' stroke-dasharray="{fp_str(*array)}"' if array else ""
+
+    def setFont(self, name, size, leading=None):
+        self._font_name = name
+        self._font_size = size
+
+    def line(self, x1, y1, x2, y2):
+        self.lines([(x1, y1, x2, y2)])
+
+    def lines(self, linelist):
+        # Все отрезки - один путь, как и в PDF
+        path = " ".join(f"M{fp_str(x1, self._y(y1))}L{fp_str(x2, self._y(y2))}" for x1, y1, x2, y2 in linelist)
+        if path:
+            self.elements.append(
+                f'<path d="{path}" fill="none" stroke="{self._stroke}" '
+                f'stroke-width="{fp_str(self._line_width)}"{self._dash}/>'
+            )
+
+    def _text(self, x, y, text, anchor=""):
+        self.fonts.add(self._font_name)
+        self.elements.append(
+            f'<text x="{fp_str(x)}" y="{fp_str(self._y(y))}" font-family="{escape(font_family(self._font_name))}" '
+            f'font-size="{fp_str(self._font_size)}" fill="{self._fill}"{anchor}>{escape(text)}</text>'
+        )
+
+    def drawString(self, x, y, text):
+        self._text(x, y, text)
+
+    def drawRightString(self, x, y, text):
+        self._text(x, y, text, ' text-anchor="end"')
+
+    def beginText(self, x=0, y=0):
+        return TextRuns(self._font_name, self._font_size, x, y)
+
+    def drawText(self, text_object):
+        for font_name, font_size, x, y, text in text_object.runs:
+            self.setFont(font_name, font_size)
+            self._text(x, y, text)
+
+
+# Фрагменты групп: (хэш группы, размер страницы) -> (разметка SVG, шрифты)
+_fragments = {}
+_fragments_lock = threading.Lock()
+
+
+def group_fragment(group, pagesize):
+    """
+    Фрагмент SVG группы сцены; рисуется один раз на группу и размер страницы
+    """
+    key = (group.digest, tuple(pagesize))
+    fragment = _fragments.get(key)
+    if fragment is None:
+        c = SvgCanvas(pagesize)
+        group.draw(c)
+        fragment = ("".join(c.elements), frozenset(c.fonts))
+        with _fragments_lock:
+            # Вытесняем самый старый фрагмент, если кэш заполнен
+            if len(_fragments) >= FRAGMENT_CACHE_SIZE:
+                _fragments.pop(next(iter(_fragments)))
+            _fragments[key] = fragment
+    return fragment
+
+
+def render_scene_svg(scene, timings=None):
+    """
+    Документ SVG для сцены (в UTF-8)
+    """
+    width, height = scene.pagesize
+    start = time.perf_counter()
+    parts, fonts = [], set()
+    for group in scene.groups:
+        markup, group_fonts = group_fragment(group, scene.pagesize)
+        parts.append(f'<g id="{group.name}">{markup}</g>')
+        fonts |= group_fonts
+        start = timed(timings, group.phase, start)
+
+    faces = "".join(font_face(name) for name in sorted(fonts) if font_registry.font_file(name))
+    document = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" xml:space="preserve" '
+        f'width="{fp_str(width)}pt" height="{fp_str(height)}pt" viewBox="0 0 {fp_str(width, height)}">'
+        + (f"<style>{faces}</style>" if faces else "")
+        + '<rect width="100%" height="100%" fill="#ffffff"/>'
+        + "".join(parts)
+        + "</svg>"
+    )
+    content = document.encode("utf-8")
+    timed(timings, "save", start)
+    return content
@@ -0,0 +1,10 @@
+"""
+Модули backend импортируются напрямую (from worksheet import ...), как в main.py.
+
+Запуск из папки backend:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,24 @@
+from reportlab import rl_config, rl_settings
+
+from render_profiles import RENDER_PROFILES, pdf_output_options
+from worksheet import WorksheetSpec, render
+
+
+def test_import_keeps_reportlab_defaults():
+    # Импорт профилей (и всего ядра) не меняет общие настройки ReportLab
+    assert rl_config.useA85 == rl_settings.useA85
+
+
+def test_output_options_are_restored_after_save():
+    previous = rl_config.useA85
+    with pdf_output_options(RENDER_PROFILES["screen"]):
+        assert rl_config.useA85 == 0
+    assert rl_config.useA85 == previous
+
+
+def test_profiles_do_not_use_ascii85():
+    spec = WorksheetSpec.from_request({"text": "Мама мыла раму", "date": "2025-09-01"})
+    for name in RENDER_PROFILES:
+        pdf = render(WorksheetSpec(**dict(spec.as_dict(), output_profile=name)))
+        assert b"ASCII85Decode" not in pdf
+    assert rl_config.useA85 == rl_settings.useA85
@@ -0,0 +1,50 @@
+import pytest
+
+from ruling import BASELINE_GRAY, HELPER_GRAY, LINE_HEIGHT, SLANT_GRAY, draw_block_ruling
+
+
+class RecordingCanvas:
+    """
+    Запоминает отрезки, которые рисует разметка, вместе с цветом обводки
+    """
+
+    def __init__(self):
+        self.color = None
+        self.segments = []
+
+    def setLineWidth(self, width):
+        pass
+
+    def setStrokeColor(self, color):
+        self.color = color
+
+    def lines(self, linelist):
+        self.segments.extend((self.color, segment) for segment in linelist)
+
+
+def block_segments(page_layout, width, height):
+    c = RecordingCanvas()
+    draw_block_ruling(c, page_layout, width, height)
+    return c.segments
+
+
+@pytest.mark.parametrize("page_layout", ["lines", "lines_oblique"])
+@pytest.mark.parametrize("height", [LINE_HEIGHT * 2, LINE_HEIGHT * 6, LINE_HEIGHT * 6 + 7, 173.5])
+def test_block_ruling_stays_inside_block(page_layout, height):
+    width = 250
+    segments = block_segments(page_layout, width, height)
+    helpers = sorted({y0 for color, (x0, y0, x1, y1) in segments if color == HELPER_GRAY})
+    baselines = sorted({y0 for color, (x0, y0, x1, y1) in segments if color == BASELINE_GRAY})
+
+    # Каждая строка целиком: основная линия и обе вспомогательные внутри блока
+    rows = int(height // (LINE_HEIGHT * 2))
+    assert len(baselines) == rows
+    assert len(helpers) == rows + 1
+    for y in helpers + baselines:
+        assert 0 <= y <= height
+    assert max(baselines) == pytest.approx(height - LINE_HEIGHT)
+    assert max(helpers) == pytest.approx(height)
+
+    for color, (x0, y0, x1, y1) in segments:
+        if color == SLANT_GRAY:
+            assert 0 <= min(y0, y1) and max(y0, y1) <= height
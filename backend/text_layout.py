@@ -0,0 +1,110 @@
+"""
+Раскладка текста прописи по ширине линейки.
+
+Строки измеряются по ширинам символов из реестра шрифтов (кэш на шрифт,
+см. fonts.FontRegistry.string_width), длинные строки переносятся по словам,
+а слово шире линейки - по символам. Для заполнения "первая буква" считается,
+сколько повторений буквы точно помещается в строку.
+
+Результаты переноса и подсчета повторений запоминаются: в пакетной
+генерации одни и те же строки раскладываются для каждого ученика заново.
+"""
+from functools import lru_cache
+
+from fonts import font_registry
+
+# Сколько разложенных строк помнить
+LAYOUT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def wrap_line(line, font_name, size, max_width):
+    """
+    Переносит строку по словам так, чтобы каждая часть помещалась в max_width.
+    Возвращает кортеж строк (хотя бы одну).
+    """
+    measure = font_registry.string_width
+    if measure(line, font_name, size) <= max_width:
+        return (line,)
+
+    space_width = measure(" ", font_name, size)
+    rows = []
+    current, current_width = "", 0.0
+    for word in line.split():
+        word_width = measure(word, font_name, size)
+        if current and current_width + space_width + word_width <= max_width:
+            current += " " + word
+            current_width += space_width + word_width
+            continue
+        if current:
+            rows.append(current)
+        if word_width <= max_width:
+            current, current_width = word, word_width
+            continue
+        # Слово шире линейки: переносим по символам
+        current, current_width = "", 0.0
+        for ch in word:
+            ch_width = measure(ch, font_name, size)
+            if current and current_width + ch_width > max_width:
+                rows.append(current)
+                current, current_width = "", 0.0
+            current += ch
+            current_width += ch_width
+    if current:
+        rows.append(current)
+    return tuple(rows) or ("",)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def repetitions(ch, font_name, size, max_width):
+    """
+    Сколько раз символ ch помещается в строку шириной max_width (не меньше одного)
+    """
+    width = font_registry.string_width(ch, font_name, size)
+    if width <= 0:
+        return 1
+    return max(1, int(max_width // width))
+
+
+def fill_with_letter(line, font_name, size, max_width):
+    """
+    Строка из первой буквы line, повторенной на всю ширину линейки
+    """
+    letter = line.lstrip()[:1]
+    if not letter:
+        return None
+    return letter * repetitions(letter, font_name, size, max_width)
+
+
+class TextRuns:
+    """
+    Текстовый объект для холстов без PDF (растр, SVG) с подмножеством API
+    reportlab PDFTextObject: запоминает строки с их шрифтом и положением,
+    а рисует их холст в drawText
+    """
+
+    def __init__(self, font_name, font_size, x=0, y=0):
+        self._font_name = font_name
+        self._font_size = font_size
+        self._leading = font_size * 1.2
+        self.runs = []
+        self.setTextOrigin(x, y)
+
+    def setTextOrigin(self, x, y):
+        self._x0 = self._x = x
+        self._y = y
+
+    def setFont(self, name, size, leading=None):
+        self._font_name = name
+        self._font_size = size
+        self._leading = size * 1.2 if leading is None else leading
+
+    def textOut(self, text):
+        self.runs.append((self._font_name, self._font_size, self._x, self._y, text))
+        self._x += font_registry.string_width(text, self._font_name, self._font_size)
+
+    def textLine(self, text=""):
+        if text:
+            self.runs.append((self._font_name, self._font_size, self._x, self._y, text))
+        self._x = self._x0
+        self._y -= self._leading
@@ -0,0 +1,541 @@
+"""
+Единое ядро рисования прописей.
+
+Все точки входа - сервер FastAPI (main.py), serverless-функции из api/,
+фоновые задачи и пакетная генерация - описывают лист через WorksheetSpec
+и рисуют его через render/render_to, поэтому разметка и текст везде
+одинаковые. Модуль не зависит от FastAPI.
+"""
+import datetime
+import io
+import os
+import time
+from dataclasses import asdict, dataclass, replace
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import black, red, Color
+from reportlab.lib.pagesizes import A4, landscape
+
+from fonts import DEFAULT_FONT_FAMILY, font_registry
+from glyphs import PUNKTIR_COLOR, draw_dotted_rows, supports_dotted
+from metrics import timed
+from render_profiles import DEFAULT_RENDER_PROFILE, RENDER_PROFILES, get_render_profile, pdf_size_report, save_pdf
+from ruling import (
+    MARGIN_LEFT, MARGIN_TOP, LINE_HEIGHT, draw_page_ruling, get_ruling_template, preview_viewport, stamp_ruling,
+)
+from scene import Scene, SceneGroup, draw_scenes_pdf
+from text_layout import fill_with_letter, wrap_line
+
+# Значения перечислимых параметров и ветка, в которую попадают неизвестные значения
+PARAM_CHOICES = {
+    "fill_type": (("all", "first_letter", "one_line"), "all"),
+    "page_layout": (("cells", "lines", "lines_oblique"), "lines"),
+    "font_type": (("punktir", "gray", "black"), "black"),
+    "page_orientation": (("portrait", "landscape"), "portrait"),
+    "font_family": (font_registry.family_names(), DEFAULT_FONT_FAMILY),
+    "output_profile": (tuple(RENDER_PROFILES), DEFAULT_RENDER_PROFILE),
+}
+
+# Значения по умолчанию, если параметр не передан в запросе
+PARAM_DEFAULTS = {
+    "fill_type": "first_letter",
+    "page_layout": "lines",
+    "font_type": "gray",
+    "page_orientation": "portrait",
+    "font_family": DEFAULT_FONT_FAMILY,
+    "output_profile": DEFAULT_RENDER_PROFILE,
+}
+
+TITLE = "Пропись для практики письма"
+# Формат даты в шапке листа; в запросе дата также принимается как ГГГГ-ММ-ДД
+DATE_FORMAT = "%d.%m.%Y"
+DATE_INPUT_FORMATS = (DATE_FORMAT, "%Y-%m-%d")
+# Количество строк текста в предпросмотре
+PREVIEW_ROWS = 5
+# Размер шрифта текста прописи и отступ текста от краев линейки
+TEXT_FONT_SIZE = 12
+TEXT_INSET = 5
+# Ограничение на количество страниц в одном документе
+MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 200))
+# Ограничение на общее количество страниц в PDF для всего класса
+CLASS_PACK_MAX_PAGES = int(os.environ.get("CLASS_PACK_MAX_PAGES", 1000))
+
+
+class PageLimitExceeded(Exception):
+    """
+    Документ не помещается в допустимое количество страниц: MAX_PAGES для
+    листа или CLASS_PACK_MAX_PAGES для PDF на весь класс. max_pages - то
+    ограничение, которое превышено.
+    """
+
+    def __init__(self, message, max_pages=MAX_PAGES):
+        # max_pages входит в args, чтобы исключение переживало передачу из процесса пула
+        super().__init__(message, max_pages)
+        self.max_pages = max_pages
+
+    def __str__(self):
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class WorksheetSpec:
+    """
+    Лист прописи в каноническом виде (на основе PropisiRequest).
+    Однозначно определяет содержимое документа и используется как ключ кэша.
+    """
+    fill_type: str = PARAM_DEFAULTS["fill_type"]
+    text: str = ""
+    page_layout: str = PARAM_DEFAULTS["page_layout"]
+    font_type: str = PARAM_DEFAULTS["font_type"]
+    page_orientation: str = PARAM_DEFAULTS["page_orientation"]
+    font_family: str = PARAM_DEFAULTS["font_family"]
+    # Профиль упаковки PDF (см. render_profiles.py): меняет байты, но не вид листа
+    output_profile: str = PARAM_DEFAULTS["output_profile"]
+    # Имя ученика и дата выводятся только в полной версии.
+    # Дата - часть параметров листа: от нее зависят байты PDF и ключ кэша
+    student_name: str = ""
+    date: str = ""
+    preview: bool = False
+
+    @classmethod
+    def from_request(cls, data, preview=False):
+        """
+        Приводит параметры запроса к каноническому виду
+        """
+        values = {}
+        for name, (choices, fallback) in PARAM_CHOICES.items():
+            value = str(data.get(name, PARAM_DEFAULTS[name]) or "").strip().lower()
+            values[name] = value if value in choices else fallback
+        values["text"] = str(data.get("text") or "")
+        if preview:
+            return cls(preview=True, **values)
+        return cls(
+            student_name=str(data.get("student_name") or ""),
+            date=normalize_date(data.get("date")),
+            **values,
+        )
+
+    @property
+    def pagesize(self):
+        if self.page_orientation == "landscape":
+            return landscape(A4)
+        return A4
+
+    def for_student(self, name, text=None):
+        """
+        Лист конкретного ученика: своя шапка и, если задан, свой текст
+        """
+        if text:
+            return replace(self, student_name=name, text=text)
+        return replace(self, student_name=name)
+
+    def as_dict(self):
+        return asdict(self)
+
+    def file_stamp(self):
+        """
+        Дата листа для имени файла (ГГГГММДД)
+        """
+        return datetime.datetime.strptime(normalize_date(self.date), DATE_FORMAT).strftime("%Y%m%d")
+
+
+def normalize_date(value):
+    """
+    Дата листа из запроса в формате DATE_FORMAT; если дата не передана
+    или не разобрана, берется сегодняшняя
+    """
+    value = str(value or "").strip()
+    for date_format in DATE_INPUT_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    return datetime.date.today().strftime(DATE_FORMAT)
+
+
+def base_font():
+    """
+    Шрифт заголовков и подписей листа (с кириллицей, если файл шрифта доступен)
+    """
+    return font_registry.resolve(DEFAULT_FONT_FAMILY)
+
+
+def text_width(pagesize):
+    """
+    Ширина строки текста на линейке листа
+    """
+    width, _ = pagesize
+    return width - 2 * MARGIN_LEFT - 2 * TEXT_INSET
+
+
+def layout_propisi_rows(spec, rows_per_page, max_width=None):
+    """
+    Раскладывает текст прописи по строкам линейки шириной max_width
+    (по умолчанию - ширина линейки листа). Длинные строки переносятся,
+    в режиме first_letter буква повторяется на всю ширину строки.
+    Пустые строки текста сохраняются как None, чтобы не сбивать отступы.
+    """
+    if not spec.text:
+        return []
+
+    if max_width is None:
+        max_width = text_width(spec.pagesize)
+    font_name = font_registry.resolve(spec.font_family)
+
+    # Разбиваем текст на строки
+    lines = spec.text.split('\n')
+
+    if spec.fill_type == "one_line":
+        # Размножаем первую строку на всю страницу (только ту часть, что помещается в строку)
+        first_line = lines[0]
+        if not first_line.strip():
+            return []
+        return [wrap_line(first_line, font_name, TEXT_FONT_SIZE, max_width)[0]] * rows_per_page
+
+    rows = []
+    for line in lines:
+        if not line.strip():  # Пустые строки оставляем пустыми
+            rows.append(None)
+        elif spec.fill_type == "first_letter":
+            # Размножаем первую букву на всю ширину строки
+            rows.append(fill_with_letter(line, font_name, TEXT_FONT_SIZE, max_width))
+        else:  # "all"
+            # Выводим текст, перенося не поместившееся на следующие строки
+            rows.extend(wrap_line(line, font_name, TEXT_FONT_SIZE, max_width))
+
+    # Пустые строки в конце текста не порождают новых страниц
+    while rows and rows[-1] is None:
+        rows.pop()
+    return rows
+
+
+def text_fill_color(font_type):
+    """
+    Цвет текста в зависимости от выбранного типа шрифта
+    """
+    if font_type == "punktir":
+        return Color(0.7, 0.7, 0.7)  # Светло-серый для пунктира
+    elif font_type == "gray":
+        return Color(0.5, 0.5, 0.5)  # Серый
+    else:  # "black"
+        return black
+
+
+def draw_propisi_header(c, spec, width, height):
+    """
+    Шапка листа: дата, заголовок и имя ученика
+    """
+    # Вся шапка - один текстовый объект
+    text = c.beginText()
+
+    # Добавляем дату в углу
+    font_name = base_font()
+    text.setFont(font_name, 8)
+    date_text = f"Дата: {spec.date}"
+    text.setTextOrigin(width - 20 - font_registry.string_width(date_text, font_name, 8), height - 20)
+    text.textOut(date_text)
+
+    # Добавляем заголовок
+    text.setFont(font_name, 14)
+    text.setTextOrigin(30, height - 40)
+    text.textOut(TITLE)
+
+    # Если указано имя ученика, добавляем его
+    if spec.student_name:
+        text.setFont(font_name, 12)
+        text.setTextOrigin(30, height - 60)
+        text.textOut(f"Ученик: {spec.student_name}")
+    c.drawText(text)
+
+
+def page_text_geometry(pagesize):
+    """
+    Положение первой строки текста и количество строк на странице (не ниже 30pt от края)
+    """
+    width, height = pagesize
+    y_position = height - MARGIN_TOP - LINE_HEIGHT
+    rows_per_page = int((y_position - 30) // (LINE_HEIGHT * 2)) + 1
+    return y_position, rows_per_page
+
+
+def visible_rows(rows, y_position, viewport=None):
+    """
+    Строки, которые попадают в область viewport по высоте (строка занимает
+    LINE_HEIGHT выше и ниже своей основной линии); остальные заменяются на None
+    """
+    if viewport is None:
+        return rows
+    _, ymin, _, ymax = viewport
+    step = LINE_HEIGHT * 2
+    return [
+        row if ymin <= y_position - i * step + LINE_HEIGHT and y_position - i * step - LINE_HEIGHT <= ymax else None
+        for i, row in enumerate(rows)
+    ]
+
+
+def draw_propisi_rows(c, rows, y_position, fill_color, font_name, dotted=False, viewport=None):
+    """
+    Выводит строки текста прописи на линейку.
+    dotted - пунктирные контуры букв для обведения (см. glyphs.py); если холст
+    или шрифт их не поддерживает, текст рисуется заливкой fill_color.
+    С областью viewport рисуются только строки, которые в нее попадают.
+    """
+    rows = visible_rows(rows, y_position, viewport)
+    if dotted and supports_dotted(c, font_name):
+        c.setStrokeColor(PUNKTIR_COLOR)
+        draw_dotted_rows(c, rows, MARGIN_LEFT + TEXT_INSET, y_position, LINE_HEIGHT * 2, font_name, TEXT_FONT_SIZE)
+        return
+    # Все строки - один текстовый объект: интерлиньяж равен шагу линейки,
+    # поэтому переход на следующую строку - оператор T* без координат
+    first = next((i for i, row in enumerate(rows) if row is not None), None)
+    if first is None:
+        return
+    last = max(i for i, row in enumerate(rows) if row is not None)
+    text = c.beginText(MARGIN_LEFT + TEXT_INSET, y_position - first * LINE_HEIGHT * 2)
+    text.setFont(font_name, TEXT_FONT_SIZE, leading=LINE_HEIGHT * 2)
+    for row in rows[first:last]:
+        text.textLine(row or "")
+    text.textOut(rows[last])
+    c.setFillColor(fill_color)
+    c.drawText(text)
+    c.setFillColor(black)
+
+
+def paginate_rows(rows, rows_per_page):
+    """
+    Делит строки по страницам (всегда хотя бы одна страница).
+    Если страниц больше MAX_PAGES, текст не обрезается, а выбрасывается PageLimitExceeded.
+    """
+    page_count = max(1, -(-len(rows) // rows_per_page))
+    if page_count > MAX_PAGES:
+        raise PageLimitExceeded(
+            f"Текст занимает {page_count} стр., а в документе может быть не более {MAX_PAGES}: "
+            f"текст после страницы {MAX_PAGES} не поместится, сократите его",
+            max_pages=MAX_PAGES,
+        )
+    return [rows[page * rows_per_page:(page + 1) * rows_per_page] for page in range(page_count)]
+
+
+def draw_preview_header(c, width, height):
+    """
+    Метка предпросмотра и заголовок.
+    Работает и с PDF-холстом, и с растровым RasterCanvas.
+    """
+    # Добавляем метку предпросмотра
+    font_name = base_font()
+    c.setFont(font_name, 10)
+    c.setFillColor(red)
+    c.drawString(width - 150, height - 20, "ПРЕДПРОСМОТР")
+    c.setFillColor(black)
+
+    # Добавляем заголовок
+    c.setFont(font_name, 14)
+    c.drawString(30, height - 40, TITLE)
+
+
+def ruling_group(page_layout, pagesize, preview=False):
+    """
+    Группа сцены с разметкой листа; в PDF вставляются готовые операторы из кэша шаблонов
+    """
+    width, height = pagesize
+    return SceneGroup(
+        "ruling", (page_layout, float(width), float(height), bool(preview)),
+        draw=lambda c: draw_page_ruling(c, page_layout, width, height, preview),
+        phase="ruling",
+        ops=lambda: get_ruling_template(page_layout, pagesize, preview),
+    )
+
+
+def text_group(rows, y_position, font_name, fill_color, dotted, viewport=None):
+    """
+    Группа сцены со строками текста прописи
+    """
+    return SceneGroup(
+        "text", (tuple(rows), y_position, font_name, fill_color.rgb(), dotted, viewport),
+        draw=lambda c: draw_propisi_rows(c, rows, y_position, fill_color, font_name, dotted, viewport),
+    )
+
+
+def build_scenes(spec):
+    """
+    Сцены страниц листа: разметка, шапка и текст каждой страницы.
+    Предпросмотр - одна страница с началом текста.
+    """
+    pagesize = spec.pagesize
+    width, height = pagesize
+    ruling = ruling_group(spec.page_layout, pagesize, spec.preview)
+    fill_color = text_fill_color(spec.font_type)
+    font_name = font_registry.resolve(spec.font_family)
+    dotted = spec.font_type == "punktir"
+
+    if spec.preview:
+        header = SceneGroup(
+            "header", ("preview", base_font(), float(width), float(height)),
+            draw=lambda c: draw_preview_header(c, width, height),
+        )
+        # Только первые строки текста
+        rows = layout_propisi_rows(spec, PREVIEW_ROWS)[:PREVIEW_ROWS]
+        text = text_group(
+            rows, height - MARGIN_TOP - LINE_HEIGHT, font_name, fill_color, dotted, preview_viewport(width, height),
+        )
+        return [Scene(pagesize, (ruling, header, text))]
+
+    header = SceneGroup(
+        "header", ("sheet", base_font(), float(width), float(height), spec.date, spec.student_name),
+        draw=lambda c: draw_propisi_header(c, spec, width, height),
+    )
+    y_position, rows_per_page = page_text_geometry(pagesize)
+    pages = paginate_rows(layout_propisi_rows(spec, rows_per_page), rows_per_page)
+    return [
+        Scene(pagesize, (ruling, header, text_group(page_rows, y_position, font_name, fill_color, dotted)))
+        for page_rows in pages
+    ]
+
+
+def render_to(spec, stream, timings=None):
+    """
+    Рисует лист в поток stream и возвращает количество страниц.
+    Предпросмотр - одна страница с началом текста; полный лист переносит
+    текст на новые страницы, пока он не закончится (не более MAX_PAGES,
+    иначе PageLimitExceeded).
+    Если передан словарь timings, в него добавляется время фаз
+    ruling (разметка), text (текст и шапка) и save (сборка PDF), в секундах.
+    Страницы рисуются по сценам листа (см. build_scenes).
+    """
+    pagesize = spec.pagesize
+    profile = get_render_profile(spec.output_profile)
+    start = time.perf_counter()
+
+    # Создаем PDF; invariant фиксирует дату создания и идентификатор документа,
+    # поэтому одинаковый лист всегда дает одинаковые байты
+    c = canvas.Canvas(stream, pagesize=pagesize, invariant=1, pageCompression=int(profile.page_compression))
+    scenes = build_scenes(spec)
+    timed(timings, "text", start)
+
+    # Разметка вставляется готовыми операторами из кэша шаблонов; общая форма
+    # нужна, только если разметка повторяется на нескольких страницах
+    page_count = draw_scenes_pdf(c, scenes, share_all=not profile.share_repeated_only, timings=timings)
+
+    # Сохраняем PDF в поток
+    start = time.perf_counter()
+    save_pdf(c, profile)
+    timed(timings, "save", start)
+    return page_count
+
+
+def render(spec, timings=None):
+    """
+    Рисует лист и возвращает содержимое PDF
+    """
+    buffer = io.BytesIO()
+    render_to(spec, buffer, timings)
+    return buffer.getvalue()
+
+
+def render_image(spec, image_format="png", dpi=96, timings=None):
+    """
+    Рисует предпросмотр сразу в PNG/WebP, без PDF и Poppler
+    """
+    # Pillow нужен только растровому предпросмотру
+    from raster import render_scene_image
+
+    # Готовые слои (разметка, шапка) берутся из кэша, поверх рисуется только изменившееся
+    start = time.perf_counter()
+    scene = build_scenes(spec)[0]
+    timed(timings, "text", start)
+    c = render_scene_image(scene, dpi, timings)
+    start = time.perf_counter()
+    content = c.to_bytes(image_format)
+    timed(timings, "save", start)
+    return content
+
+
+def render_svg(spec, timings=None):
+    """
+    Рисует первую страницу листа (или предпросмотр) в SVG
+    """
+    from svg import render_scene_svg
+
+    start = time.perf_counter()
+    scene = build_scenes(spec)[0]
+    timed(timings, "text", start)
+    return render_scene_svg(scene, timings)
+
+
+def render_class_pack_to(spec, stream, students, timings=None):
+    """
+    Один PDF на весь класс. Разметка и страницы текста рисуются один раз
+    как Form XObject, для каждого ученика меняется только шапка.
+    students - список {"name", "text"}. Возвращает количество страниц.
+    Если страниц больше CLASS_PACK_MAX_PAGES, выбрасывается PageLimitExceeded
+    до начала рисования.
+    """
+    start = time.perf_counter()
+    pagesize = spec.pagesize
+    width, height = pagesize
+    y_position, rows_per_page = page_text_geometry(pagesize)
+
+    # Сначала раскладываем текст (один раз на текст) и считаем страницы всего пакета
+    sheets = [spec.for_student(student["name"], student["text"]) for student in students]
+    pages_by_text = {}
+    total_pages = 0
+    for sheet in sheets:
+        pages = pages_by_text.get(sheet.text)
+        if pages is None:
+            pages = pages_by_text[sheet.text] = paginate_rows(layout_propisi_rows(sheet, rows_per_page), rows_per_page)
+        total_pages += len(pages)
+    if total_pages > CLASS_PACK_MAX_PAGES:
+        raise PageLimitExceeded(
+            f"PDF для класса занимает {total_pages} стр., а допускается не более {CLASS_PACK_MAX_PAGES}: "
+            "уменьшите количество учеников или сократите текст",
+            max_pages=CLASS_PACK_MAX_PAGES,
+        )
+    start = timed(timings, "text", start)
+
+    profile = get_render_profile(spec.output_profile)
+    c = canvas.Canvas(stream, pagesize=pagesize, invariant=1, pageCompression=int(profile.page_compression))
+    fill_color = text_fill_color(spec.font_type)
+    font_name = font_registry.resolve(spec.font_family)
+    dotted = spec.font_type == "punktir"
+
+    # Текст -> имена форм его страниц (None для страницы без текста)
+    text_forms = {}
+    page_count = 0
+    for sheet in sheets:
+        forms = text_forms.get(sheet.text)
+        if forms is None:
+            forms = []
+            for page_rows in pages_by_text[sheet.text]:
+                if not page_rows:
+                    forms.append(None)
+                    continue
+                name = f"text_{len(text_forms)}_{len(forms)}"
+                c.beginForm(name, 0, 0, width, height)
+                draw_propisi_rows(c, page_rows, y_position, fill_color, font_name, dotted)
+                c.endForm()
+                forms.append(name)
+            text_forms[sheet.text] = forms
+            start = timed(timings, "text", start)
+
+        for form_name in forms:
+            if page_count:
+                c.showPage()
+                start = timed(timings, "save", start)
+            page_count += 1
+            draw_propisi_header(c, sheet, width, height)
+            start = timed(timings, "text", start)
+            stamp_ruling(c, spec.page_layout, pagesize)
+            start = timed(timings, "ruling", start)
+            if form_name:
+                c.doForm(form_name)
+
+    save_pdf(c, profile)
+    timed(timings, "save", start)
+    return page_count
+
+
+def render_size_report(spec):
+    """
+    Размер листа в каждом профиле вывода с разбивкой по видам данных
+    """
+    return {name: pdf_size_report(render(replace(spec, output_profile=name))) for name in RENDER_PROFILES}